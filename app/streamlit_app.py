@@ -1,8 +1,15 @@
 import streamlit as st
+import numpy as np
 from PIL import Image
 from pathlib import Path
-import subprocess, sys, os, glob
+import subprocess, sys, os, glob, shutil, tempfile
 from calorie_map import get_calorie_info
+from retention import prune_in_background
+
+# retention for run folders and leftover uploads, applied in the background after each run
+RUNS_MAX_COUNT = int(os.environ.get('RUNS_MAX_COUNT', '200'))
+RUNS_MAX_BYTES = int(os.environ.get('RUNS_MAX_BYTES', str(1024 ** 3)))
+RUNS_MAX_AGE_S = float(os.environ.get('RUNS_MAX_AGE_S', str(7 * 24 * 3600)))
 
 st.set_page_config(layout='wide')
 st.title('FoodCal - YOLOv12 Inference (Stable)')
@@ -50,9 +57,9 @@ if run_btn:
     if uploaded is None:
         st.warning('Please upload an image first.')
     else:
-        # save uploaded locally
-        tmp_dir = Path('tmp_uploads')
-        tmp_dir.mkdir(exist_ok=True)
+        # save uploaded locally, in a folder of its own that is removed once detect.py has read it
+        Path('tmp_uploads').mkdir(exist_ok=True)
+        tmp_dir = Path(tempfile.mkdtemp(dir='tmp_uploads'))
         img_path = tmp_dir / uploaded.name
         img.save(img_path)
 
@@ -91,7 +98,7 @@ if run_btn:
             '--weights', str(model_path.resolve()),
             '--source', str(img_path.resolve()),
             '--conf', str(conf),
-            '--save-txt',
+            '--save-format', 'npz',
             '--save-img'
         ]
 
@@ -100,6 +107,9 @@ if run_btn:
         st.text('Command: ' + ' '.join(cmd))
 
         proc = subprocess.run(cmd, capture_output=True, text=False, cwd=cwd, env=os.environ.copy())
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        prune_in_background([os.path.join(cwd, 'runs', 'detect'), 'tmp_uploads'],
+                            max_count=RUNS_MAX_COUNT, max_bytes=RUNS_MAX_BYTES, max_age_s=RUNS_MAX_AGE_S)
         # proc.stdout/proc.stderr might be bytes; decode safely
         stdout = proc.stdout.decode('utf-8', errors='replace') if isinstance(proc.stdout, (bytes, bytearray)) else str(proc.stdout)
         stderr = proc.stderr.decode('utf-8', errors='replace') if isinstance(proc.stderr, (bytes, bytearray)) else str(proc.stderr)
@@ -110,12 +120,19 @@ if run_btn:
             st.error('Detection failed (returncode != 0). See stderr above.')
             st.stop()
 
-        # find latest runs/detect/exp*
-        runs = sorted(glob.glob(os.path.join(cwd, 'runs', 'detect', 'exp*')))
-        if not runs:
-            st.error('No detection run folder found under yolov12/runs/detect/')
-            st.stop()
-        latest = runs[-1]
+        # detect.py prints the run folder it created; fall back to the highest-numbered runs/detect/exp*
+        latest = None
+        for line in stdout.splitlines():
+            if 'Saving results to:' in line:
+                latest = line.split('Saving results to:', 1)[1].strip()
+                if not os.path.isabs(latest):
+                    latest = os.path.join(cwd, latest)
+        if latest is None:
+            runs = [r for r in glob.glob(os.path.join(cwd, 'runs', 'detect', 'exp*')) if os.path.basename(r)[3:].isdigit()]
+            if not runs:
+                st.error('No detection run folder found under yolov12/runs/detect/')
+                st.stop()
+            latest = max(runs, key=lambda r: int(os.path.basename(r)[3:]))
         st.success(f'Detection completed. Output folder: {latest}')
 
         # show annotated image
@@ -125,22 +142,18 @@ if run_btn:
         else:
             st.warning('Annotated image not found at ' + out_img)
 
-        # read label txt
-        label_txt = os.path.join(latest, 'labels', Path(img_path).stem + '.txt')
+        # read the run's detections.npz (class ids are one array, see detect.NpzSink)
+        det_file = os.path.join(latest, 'detections.npz')
         counts = {}
         total_cal = 0
-        if os.path.exists(label_txt):
-            with open(label_txt) as f:
-                for line in f:
-                    parts = line.strip().split()
-                    if len(parts) < 5:
-                        continue
-                    cls = int(float(parts[0]))
-                    counts[cls] = counts.get(cls, 0) + 1
-                    info = get_calorie_info(cls)
-                    total_cal += info.get('cal', 0)
+        if os.path.exists(det_file):
+            with np.load(det_file) as dets:
+                classes, cnts = np.unique(dets['cls'], return_counts=True)
+            for cls, cnt in zip(classes.tolist(), cnts.tolist()):
+                counts[cls] = cnt
+                total_cal += get_calorie_info(cls).get('cal', 0) * cnt
         else:
-            st.warning('Label txt not found; ensure yolov12 detect used --save-txt')
+            st.warning('detections.npz not found; ensure yolov12 detect used --save-format npz')
 
         st.subheader('Detections')
         if counts:
@@ -1,8 +1,21 @@
 #!/usr/bin/env bash
 set -e
-if [ -n "$MODEL_URL" ]; then
+MODEL_FILE=/home/render/models/best.pt
+# the URL best.pt was fetched from; a different MODEL_URL (a new release) triggers a fresh download
+URL_FILE="$MODEL_FILE.url"
+# MODEL_REFRESH=1 forces a fresh download; otherwise a model already on the disk from the same MODEL_URL is reused
+if [ -n "$MODEL_URL" ] && { [ "$MODEL_REFRESH" = "1" ] || [ ! -s "$MODEL_FILE" ] || [ "$(cat "$URL_FILE" 2>/dev/null)" != "$MODEL_URL" ]; }; then
   mkdir -p /home/render/models
   echo "Downloading model from $MODEL_URL"
-  wget -O /home/render/models/best.pt "$MODEL_URL" || { echo "Model download failed"; exit 0; }
+  start=$(date +%s)
+  # download next to the target and rename, so a failed download never leaves a truncated best.pt behind
+  if wget -q -O "$MODEL_FILE.part" "$MODEL_URL"; then
+    mv "$MODEL_FILE.part" "$MODEL_FILE"
+    printf '%s\n' "$MODEL_URL" > "$URL_FILE"
+    echo "Model downloaded in $(( $(date +%s) - start ))s"
+  else
+    rm -f "$MODEL_FILE.part"
+    echo "Model download failed"
+  fi
 fi
 exec "$@"
@@ -1,87 +1,904 @@
-from fastapi import FastAPI, File, UploadFile, Form
-from fastapi.responses import JSONResponse
+from fastapi import FastAPI, Form, BackgroundTasks, Header, Request, WebSocket, WebSocketDisconnect
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import JSONResponse, PlainTextResponse, Response
 import uvicorn
-import tempfile, os, sys, subprocess, glob, base64
+import os, sys, io, base64, threading, time, uuid
 from pathlib import Path
 from typing import Optional
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+import asyncio, importlib, json, struct, tarfile, zipfile
+import numpy as np
+from PIL import Image
+from src.batching import MicroBatcher, QueueFull
+from src.result_cache import ResultCache, make_key
+from src.model_registry import ModelRegistry, UnknownModel, parse_model_specs
+from src.metrics import MetricsRegistry, MetricsMiddleware
+from src.calorie_map import get_calorie_info
+from src.admission import AdmissionController, DeadlineExceeded, Rejected, parse_deadline
+from src.uploads import BadUpload, UploadTooLarge, read_form
+from src.worker_pool import WorkerPool
+from src.single_flight import SingleFlight
+from src.retention import prune
+
+# optional fast serializers: orjson for JSON bodies, msgpack for Accept: application/msgpack
+try:
+    import orjson
+except ImportError:
+    orjson = None
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
 
 app = FastAPI(title="YOLOv12 Inference Server - FoodCal")
 
+# Prometheus metrics, scraped from GET /metrics
+METRICS = MetricsRegistry()
+STAGE_SECONDS = METRICS.histogram("foodcal_stage_seconds", "Time spent per pipeline stage (model stages are per batch)", ["stage"])
+REQUESTS = METRICS.counter("foodcal_requests_total", "HTTP requests by route and status", ["route", "status"])
+ERRORS = METRICS.counter("foodcal_errors_total", "HTTP responses with status >= 400 by route and status", ["route", "status"])
+REQUEST_SECONDS = METRICS.histogram("foodcal_request_seconds", "End-to-end request latency by route", ["route"])
+BATCH_SIZE = METRICS.histogram("foodcal_batch_size", "Images per forward pass", buckets=(1, 2, 4, 8, 16, 32, 64))
+app.add_middleware(MetricsMiddleware, requests=REQUESTS, errors=ERRORS, latency=REQUEST_SECONDS)
+
 # Configuration: set these via environment variables on Render or edit defaults
 YOLOV12_DIR = os.environ.get("YOLOV12_DIR", "/home/render/yolov12")  # where repo lives in container
 MODEL_PATH = os.environ.get("MODEL_PATH", "/home/render/models/best.pt")  # default path to best.pt
 CONF_DEFAULT = float(os.environ.get("CONF_DEFAULT", "0.25"))
+# floor for client conf: a batch runs at its lowest conf, and near-zero thresholds make NMS crawl for every image in it
+CONF_MIN = float(os.environ.get("CONF_MIN", "0.01"))
+IMGSZ_DEFAULT = int(os.environ.get("IMGSZ_DEFAULT", "640"))
+# client-supplied imgsz must be within [IMGSZ_MIN, IMGSZ_MAX]; it is rounded up to the model stride
+IMGSZ_MIN = int(os.environ.get("IMGSZ_MIN", "32"))
+IMGSZ_MAX = int(os.environ.get("IMGSZ_MAX", "1280"))
+IMGSZ_STRIDE = 32
+# Uploads are streamed into memory (never to disk) and rejected with 413 as soon as they pass these sizes
+MAX_UPLOAD_BYTES = int(os.environ.get("MAX_UPLOAD_BYTES", str(20 * 1024 * 1024)))
+BULK_MAX_UPLOAD_BYTES = int(os.environ.get("BULK_MAX_UPLOAD_BYTES", str(256 * 1024 * 1024)))
+# WARMUP=1 pushes one dummy image through the whole request path at startup, before /readyz reports ready
+WARMUP = os.environ.get("WARMUP", "1") == "1"
+# Inference backend: "torch" (ultralytics), "onnx" (onnxruntime CPU; best.pt is exported to best.onnx on first load)
+# or "auto" (onnx only for .onnx weights). ORT_*_THREADS=0 lets onnxruntime pick.
+BACKEND = os.environ.get("BACKEND", "auto")
+ORT_INTRA_OP_THREADS = int(os.environ.get("ORT_INTRA_OP_THREADS", "0"))
+ORT_INTER_OP_THREADS = int(os.environ.get("ORT_INTER_OP_THREADS", "0"))
+# INFER_WORKERS=N runs torch models in N worker processes, each pinned to its own cores; the weights are fused
+# once into <weights>.fused.pt and memory-mapped by every worker, so RSS does not grow with a copy per worker.
+# 0 keeps inference in the server process. ONNX models always run in-process.
+INFER_WORKERS = int(os.environ.get("INFER_WORKERS", "0"))
+# Extra models selectable per request via the `model` field, e.g. MODELS="yolov12n=yolov12n.pt,yolov12s=yolov12s.pt".
+# MODEL_PATH is always registered as DEFAULT_MODEL and stays loaded; the others load on first use and are
+# evicted least-recently-used beyond MODEL_CACHE_MAX_MODELS / MODEL_CACHE_MAX_BYTES.
+DEFAULT_MODEL = os.environ.get("DEFAULT_MODEL", "best")
+MODELS = os.environ.get("MODELS", "")
+MODEL_CACHE_MAX_MODELS = int(os.environ.get("MODEL_CACHE_MAX_MODELS", "3"))
+MODEL_CACHE_MAX_BYTES = int(os.environ.get("MODEL_CACHE_MAX_BYTES", str(2 * 1024 ** 3)))
+# Hot reload: poll MODEL_PATH every MODEL_WATCH_INTERVAL_S seconds (0 disables) and/or POST /admin/reload
+# with the X-Admin-Token header (the endpoint is disabled while ADMIN_TOKEN is unset)
+MODEL_WATCH_INTERVAL_S = float(os.environ.get("MODEL_WATCH_INTERVAL_S", "30"))
+ADMIN_TOKEN = os.environ.get("ADMIN_TOKEN", "")
+# Micro-batching: collect concurrent requests for up to BATCH_WAIT_MS or BATCH_MAX_SIZE images
+BATCH_MAX_SIZE = int(os.environ.get("BATCH_MAX_SIZE", "8"))
+BATCH_WAIT_MS = float(os.environ.get("BATCH_WAIT_MS", "10"))
+BATCH_QUEUE_SIZE = int(os.environ.get("BATCH_QUEUE_SIZE", "256"))
+# Priority lanes: /detect (and the warmup) is "interactive", /detect/batch is "bulk"; each lane has its own queue
+# and the batcher alternates between them by weight. While interactive p95 (enqueue -> result, last 10s) is
+# above INTERACTIVE_P95_TARGET_MS (0 disables the target), interactive work goes strictly first and bulk batches shrink.
+INTERACTIVE_WEIGHT = int(os.environ.get("INTERACTIVE_WEIGHT", "4"))
+BULK_WEIGHT = int(os.environ.get("BULK_WEIGHT", "1"))
+INTERACTIVE_P95_TARGET_MS = float(os.environ.get("INTERACTIVE_P95_TARGET_MS", "1000"))
+# Admission control: at most MAX_INFLIGHT requests doing inference, MAX_PENDING waiting for a slot (429 beyond),
+# and 503 + Retry-After once the estimated wait exceeds MAX_QUEUE_WAIT_S or the client's own deadline
+# (X-Request-Timeout-Ms, or X-Request-Deadline as unix epoch seconds); expired work is dropped before inference
+MAX_INFLIGHT = int(os.environ.get("MAX_INFLIGHT", "16"))
+MAX_PENDING = int(os.environ.get("MAX_PENDING", "64"))
+MAX_QUEUE_WAIT_S = float(os.environ.get("MAX_QUEUE_WAIT_S", "30"))
+# upload bodies held in memory at once; each request reserves its Content-Length (or its endpoint's maximum)
+# before reading and keeps it until it has answered; past this, new requests get 503 uploads_busy
+MAX_UPLOAD_BUFFER_BYTES = int(os.environ.get("MAX_UPLOAD_BUFFER_BYTES", str(512 * 1024 * 1024)))
+# Result cache for repeated uploads (CACHE_MAX_ENTRIES=0 disables it)
+CACHE_MAX_ENTRIES = int(os.environ.get("CACHE_MAX_ENTRIES", "512"))
+CACHE_MAX_BYTES = int(os.environ.get("CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+CACHE_TTL_S = float(os.environ.get("CACHE_TTL_S", "600"))
+# Optional disk output: each request writes to its own runs/serve/<id>/ after the response is sent
+SAVE_RUNS = os.environ.get("SAVE_RUNS", "0") == "1"
+# Retention for yolov12/runs/{serve,detect}: pruned every RUNS_PRUNE_INTERVAL_S seconds (0 disables), oldest first,
+# down to RUNS_MAX_COUNT entries and RUNS_MAX_BYTES per directory, and nothing older than RUNS_MAX_AGE_S
+RUNS_PRUNE_INTERVAL_S = float(os.environ.get("RUNS_PRUNE_INTERVAL_S", "300"))
+RUNS_MAX_COUNT = int(os.environ.get("RUNS_MAX_COUNT", "200"))
+RUNS_MAX_BYTES = int(os.environ.get("RUNS_MAX_BYTES", str(1024 ** 3)))
+RUNS_MAX_AGE_S = float(os.environ.get("RUNS_MAX_AGE_S", str(7 * 24 * 3600)))
+# Annotated image delivery: return_image=none|inline|ref; "ref" images are rendered on first fetch
+RETURN_IMAGE_DEFAULT = os.environ.get("RETURN_IMAGE_DEFAULT", "inline")
+IMAGE_STORE_TTL_S = float(os.environ.get("IMAGE_STORE_TTL_S", "120"))
+IMAGE_STORE_MAX_BYTES = int(os.environ.get("IMAGE_STORE_MAX_BYTES", str(64 * 1024 * 1024)))
+RETURN_IMAGE_MODES = ("none", "inline", "ref")
+# /detect response formats, chosen by the Accept header (JSON when nothing else matches):
+#   application/json     {"ok", "detections": [{class, x, y, w, h, conf}], "calories", ...}
+#   application/msgpack  same fields, detections as [[class, x, y, w, h, conf], ...], annotated image as raw JPEG bytes
+#   application/vnd.foodcal.f32 (or application/octet-stream)  16-byte header "<4sHHIf" = (b"FCAL", version 1,
+#                        6 columns, n rows, calorie total), then n * 6 little-endian float32 [class, x, y, w, h, conf]
+PACKED_MAGIC = b"FCAL"
+PACKED_HEADER = struct.Struct("<4sHHIf")
+
+# DEBUG=1 adds stdout/stderr diagnostics to /detect responses
+DEBUG = os.environ.get("DEBUG", "0") == "1"
+
+# /detect/batch: many images (or one zip/tar archive) per request, decoded in parallel
+BULK_MAX_IMAGES = int(os.environ.get("BULK_MAX_IMAGES", "500"))
+BULK_BATCH_SIZE = int(os.environ.get("BULK_BATCH_SIZE", "16"))
+DECODE_WORKERS = int(os.environ.get("DECODE_WORKERS", str(min(8, os.cpu_count() or 1))))
+# archives are expanded in a small pool of their own, so a slow archive never holds up /detect decoding;
+# every member (image or not) counts towards ARCHIVE_MAX_MEMBERS and the expanded BULK_MAX_UPLOAD_BYTES
+ARCHIVE_WORKERS = int(os.environ.get("ARCHIVE_WORKERS", "2"))
+ARCHIVE_MAX_MEMBERS = int(os.environ.get("ARCHIVE_MAX_MEMBERS", "2000"))
+IMAGE_SUFFIXES = (".jpg", ".jpeg", ".png", ".bmp", ".webp")
+
+# /ws/detect: real-time frames over a WebSocket; at most WS_MAX_SESSIONS concurrent streams
+WS_MAX_SESSIONS = int(os.environ.get("WS_MAX_SESSIONS", "8"))
+
+# detect.py module, imported once at startup (error holds the reason it could not be);
+# startup holds the warm-start phase (starting|importing|loading|warming|ready|failed) and its timings
+STATE = {"error": None, "detect": None, "startup": {"phase": "starting"}}
+_infer_lock = threading.Lock()  # the model is not safe to call from several threads at once
+_background_tasks = set()  # keeps fire-and-forget asyncio tasks referenced until they finish
+_decode_pool = ThreadPoolExecutor(max_workers=DECODE_WORKERS, thread_name_prefix="decode")
+_archive_pool = ThreadPoolExecutor(max_workers=max(1, ARCHIVE_WORKERS), thread_name_prefix="archive")
+
+
+def _import_detect():
+    yolodir = Path(YOLOV12_DIR)
+    if not yolodir.exists() or not (yolodir / "detect.py").exists():
+        STATE["error"] = {"ok": False, "error": "yolov12_not_found", "path": str(YOLOV12_DIR)}
+        return
+    if str(yolodir) not in sys.path:
+        sys.path.insert(0, str(yolodir))
+    import detect
+    STATE["detect"] = detect
+
+
+def _import_backend():
+    # detect.py plus the inference stack the default model needs, so no request pays for importing torch
+    _import_detect()
+    if STATE["detect"] is None:
+        return
+    onnx = BACKEND == "onnx" or (BACKEND == "auto" and MODEL_PATH.endswith(".onnx"))
+    for name in (["onnxruntime"] if onnx else ["torch", "ultralytics"]):
+        try:
+            importlib.import_module(name)
+        except ImportError as e:
+            print(f"Could not preload {name}: {e}")
+
+
+def _load_detector(weights):
+    # registry loader: local paths must exist; bare names (e.g. yolov12n.pt) are resolved by ultralytics
+    if (os.sep in weights or weights == MODEL_PATH) and not Path(weights).exists():
+        raise FileNotFoundError(weights)
+    t0 = time.perf_counter()
+    detect = STATE["detect"]
+    if INFER_WORKERS > 0 and BACKEND != "onnx" and not weights.endswith(".onnx"):
+        detector = WorkerPool(YOLOV12_DIR, detect.resolve_mapped(weights), INFER_WORKERS,
+                              conf=CONF_DEFAULT, imgsz=IMGSZ_DEFAULT, warmup=WARMUP)
+    else:
+        detector = detect.load_detector(weights, backend=BACKEND, conf=CONF_DEFAULT, imgsz=IMGSZ_DEFAULT,
+                                        intra_op_threads=ORT_INTRA_OP_THREADS, inter_op_threads=ORT_INTER_OP_THREADS)
+    if WARMUP:
+        detector.warmup(imgsz=IMGSZ_DEFAULT, conf=CONF_DEFAULT)
+    print(f"Loaded {weights} in {time.perf_counter() - t0:.2f}s")
+    return detector
+
+
+def _close_model(name, model):
+    # an evicted or replaced model whose last request has finished: stop its inference worker processes
+    if hasattr(model, "close"):
+        model.close()
+
+
+registry = ModelRegistry(_load_detector, {**parse_model_specs(MODELS), DEFAULT_MODEL: MODEL_PATH}, pinned=[DEFAULT_MODEL],
+                         max_bytes=MODEL_CACHE_MAX_BYTES, max_models=MODEL_CACHE_MAX_MODELS, on_evict=_close_model)
+
+
+async def _get_detector(name):
+    # (detector, None) or (None, error response); loads the model on first use. The caller holds the detector
+    # until registry.release(detector), so a reload or eviction can't close it mid-request
+    if STATE["detect"] is None:
+        if STATE["error"] is None:
+            return None, JSONResponse({"ok": False, "error": "starting", "phase": STATE["startup"]["phase"]},
+                                      status_code=503, headers={"Retry-After": "1"})
+        return None, JSONResponse(STATE["error"], status_code=500)
+    detector = registry.acquire(name, load=False)
+    if detector is not None:
+        return detector, None
+    try:
+        return await run_in_threadpool(registry.acquire, name), None
+    except UnknownModel:
+        return None, JSONResponse({"ok": False, "error": "unknown_model", "model": name, "available": registry.names()}, status_code=400)
+    except FileNotFoundError:
+        return None, JSONResponse({"ok": False, "error": "model_not_found", "model_path": registry.specs[name]}, status_code=500)
+    except Exception as e:
+        return None, JSONResponse(_error_body("model_load_failed", e), status_code=500)
+
+
+def _model_lock(detector):
+    # worker pools dispatch each call to a separate process; everything else shares one in-process model
+    return nullcontext() if getattr(detector, "thread_safe", False) else _infer_lock
+
+
+def _run_batch(key, items):
+    # key: (detector, imgsz); items: list of (img, conf); one forward pass at the lowest conf, each caller filters its own
+    detector, imgsz = key
+    imgs = [img for img, _ in items]
+    min_conf = min(c for _, c in items)
+    with _model_lock(detector):
+        preds = detector.predict(imgs, conf=min_conf, imgsz=imgsz)
+        timings = dict(detector.last_timings)
+    for stage, seconds in timings.items():
+        STAGE_SECONDS.observe(seconds, stage)
+    BATCH_SIZE.observe(len(imgs))
+    return preds
+
+
+batcher = MicroBatcher(_run_batch, max_batch_size=BATCH_MAX_SIZE, max_wait_ms=BATCH_WAIT_MS, max_queue=BATCH_QUEUE_SIZE,
+                       max_concurrency=max(1, INFER_WORKERS),
+                       lanes=(("interactive", INTERACTIVE_WEIGHT, None), ("bulk", BULK_WEIGHT, BULK_BATCH_SIZE)),
+                       p95_target_ms=INTERACTIVE_P95_TARGET_MS)
+admission = AdmissionController(max_inflight=MAX_INFLIGHT, max_pending=MAX_PENDING, max_wait_s=MAX_QUEUE_WAIT_S,
+                                max_upload_bytes=MAX_UPLOAD_BUFFER_BYTES)
+cache = ResultCache(max_entries=CACHE_MAX_ENTRIES, max_bytes=CACHE_MAX_BYTES, ttl_s=CACHE_TTL_S)
+# short-lived store behind /images/{token}; same LRU/TTL/byte-budget policy as the result cache
+images = ResultCache(max_entries=4096, max_bytes=IMAGE_STORE_MAX_BYTES, ttl_s=IMAGE_STORE_TTL_S)
+# identical uploads (same bytes, conf, imgsz and model version) that arrive while one is being inferred share it
+inflight = SingleFlight()
+
+METRICS.gauge("foodcal_queue_depth", "Requests waiting in the batching queue", fn=lambda: batcher.depth)
+METRICS.gauge("foodcal_lane_queue_depth", "Requests waiting per priority lane", ["lane"],
+              fn=lambda: {(name,): len(lane.queue) for name, lane in batcher.lanes.items()})
+METRICS.gauge("foodcal_lane_p95_seconds", "p95 enqueue-to-result latency per priority lane over the last 10s", ["lane"],
+              fn=lambda: {(name,): lane.p95() for name, lane in batcher.lanes.items()})
+METRICS.gauge("foodcal_inflight", "Requests admitted and doing inference", fn=lambda: admission.inflight)
+METRICS.gauge("foodcal_pending", "Requests waiting for an inference slot", fn=lambda: admission.pending)
+METRICS.gauge("foodcal_estimated_wait_seconds", "Estimated queue wait for a new request", fn=admission.estimated_wait)
+METRICS.counter("foodcal_rejected_total", "Requests rejected by admission control", ["reason"],
+                fn=lambda: {(k,): v for k, v in admission.rejected.items()})
+WS_FRAMES = METRICS.counter("foodcal_ws_frames_total", "WebSocket frames processed, dropped (latest frame wins), rejected by admission or failed", ["outcome"])
+METRICS.gauge("foodcal_ws_sessions", "Open WebSocket detection sessions", fn=lambda: STATE.get("ws_sessions", 0))
+METRICS.counter("foodcal_expired_total", "Requests dropped because their deadline passed",
+                fn=lambda: admission.expired + batcher.expired)
+METRICS.counter("foodcal_cache_events_total", "Result cache hits/misses/evictions", ["event"],
+              fn=lambda: {("hit",): cache.hits, ("miss",): cache.misses, ("eviction",): cache.evictions})
+METRICS.counter("foodcal_coalesced_requests_total", "Requests answered by an identical in-flight request's inference",
+                fn=lambda: inflight.shared)
+METRICS.gauge("foodcal_cache_bytes", "Approximate bytes held by the result cache", fn=lambda: cache.bytes)
+METRICS.gauge("foodcal_models_loaded", "Models currently resident", fn=lambda: len(registry.stats()["loaded"]))
+
+
+def _weights_stamp(path):
+    try:
+        st = os.stat(path)
+        return (st.st_mtime_ns, st.st_size)
+    except OSError:
+        return None
+
+
+async def _reload(name):
+    try:
+        await run_in_threadpool(registry.reload, name)
+    except Exception as e:
+        print(f"Reload of {name} failed, keeping the current model: {e!r}")
+
+
+async def _watch_model_path():
+    # reload DEFAULT_MODEL once MODEL_PATH has changed and its size/mtime held steady for one interval,
+    # so a best.pt that is still being copied in is never picked up half-written
+    loaded = _weights_stamp(MODEL_PATH)
+    candidate = None
+    while True:
+        await asyncio.sleep(MODEL_WATCH_INTERVAL_S)
+        stamp = _weights_stamp(MODEL_PATH)
+        if stamp is None or stamp == loaded:
+            candidate = None
+            continue
+        if stamp != candidate:
+            candidate = stamp
+            continue
+        print(f"{MODEL_PATH} changed, reloading in the background")
+        await _reload(DEFAULT_MODEL)
+        loaded, candidate = stamp, None
+
+
+async def _warm_request_path(detector):
+    # one dummy image through batching, row building, rendering and serialization (lazy PIL/encoder init)
+    img = Image.new("RGB", (IMGSZ_DEFAULT, IMGSZ_DEFAULT))
+    preds = await batcher.submit((detector, IMGSZ_DEFAULT), (img, CONF_DEFAULT))
+    rows = _detection_rows(preds, img.size, CONF_DEFAULT)
+    jpeg = await run_in_threadpool(_render_jpeg, img, preds, CONF_DEFAULT, detector.names)
+    _json_response({"detections": _detections(rows), "calories": _calories(rows), "annotated_image_b64": base64.b64encode(jpeg).decode()})
+
+
+async def _prune_runs():
+    # background retention for run outputs; the scan and deletes run in a worker thread
+    roots = [os.path.join(YOLOV12_DIR, "runs", sub) for sub in ("serve", "detect")]
+    while True:
+        for root in roots:
+            try:
+                result = await run_in_threadpool(prune, root, max_count=RUNS_MAX_COUNT, max_bytes=RUNS_MAX_BYTES,
+                                                 max_age_s=RUNS_MAX_AGE_S)
+                if result["removed"]:
+                    print(f"Pruned {result['removed']} entries ({result['freed_bytes']} bytes) from {root}")
+            except Exception as e:
+                print(f"Pruning {root} failed: {e!r}")
+        await asyncio.sleep(RUNS_PRUNE_INTERVAL_S)
+
+
+async def _warm_start():
+    # import -> load -> warm in the background: /healthz answers right away, /readyz once this has finished
+    startup = STATE["startup"]
+    t0 = time.perf_counter()
+    startup["phase"] = "importing"
+    await run_in_threadpool(_import_backend)
+    startup["import_s"] = round(time.perf_counter() - t0, 3)
+    print(f"Imported inference modules in {startup['import_s']:.2f}s")
+    if STATE["detect"] is not None:
+        startup["phase"] = "loading"
+        t1 = time.perf_counter()
+        detector = None
+        try:
+            detector = await run_in_threadpool(registry.get, DEFAULT_MODEL)
+        except FileNotFoundError:
+            STATE["error"] = {"ok": False, "error": "model_not_found", "model_path": MODEL_PATH}
+        except Exception as e:
+            STATE["error"] = _error_body("model_load_failed", e)
+        startup["load_s"] = round(time.perf_counter() - t1, 3)
+        print(f"Model load finished in {startup['load_s']:.2f}s")
+        if detector is not None and WARMUP:
+            startup["phase"] = "warming"
+            t2 = time.perf_counter()
+            try:
+                await _warm_request_path(detector)
+            except Exception as e:
+                print(f"Warmup request failed: {e!r}")
+            startup["warmup_s"] = round(time.perf_counter() - t2, 3)
+        if MODEL_WATCH_INTERVAL_S > 0:
+            STATE["watcher"] = asyncio.get_running_loop().create_task(_watch_model_path())
+    startup["total_s"] = round(time.perf_counter() - t0, 3)
+    startup["phase"] = "ready" if STATE["error"] is None else "failed"
+    print(f"Startup {startup['phase']} after {startup['total_s']:.2f}s")
+
+
+@app.on_event("startup")
+async def load_model():
+    batcher.start()
+    STATE["warm_start"] = asyncio.get_running_loop().create_task(_warm_start())
+    if RUNS_PRUNE_INTERVAL_S > 0:
+        STATE["pruner"] = asyncio.get_running_loop().create_task(_prune_runs())
+
+
+@app.on_event("shutdown")
+async def stop_batcher():
+    for task in ("warm_start", "watcher", "pruner"):
+        if STATE.get(task) is not None:
+            STATE[task].cancel()
+    await batcher.stop()
+    for name in registry.names():
+        model = registry.peek(name)
+        if hasattr(model, "close"):
+            model.close()  # stop inference worker processes
+
+
+def _detection_rows(preds, img_size, conf):
+    # (n, 6) float64 rows [class, x, y, w, h, conf] for boxes at or above conf; x, y, w, h are the
+    # normalized YOLO center/size, rounded to 6 places
+    boxes, scores, classes = preds
+    keep = np.asarray(scores) >= conf
+    boxes = np.asarray(boxes, dtype=np.float64).reshape(-1, 4)[keep]
+    rows = np.empty((len(boxes), 6))
+    rows[:, 0] = np.asarray(classes)[keep]
+    rows[:, 1:5] = STATE["detect"].xyxy_to_yolo(boxes, *img_size)
+    rows[:, 5] = np.asarray(scores)[keep]
+    return rows.round(6)
+
+
+def _detections(rows):
+    # JSON shape of detection rows
+    return [{"class": int(c), "x": x, "y": y, "w": w, "h": h, "conf": s} for c, x, y, w, h, s in rows.tolist()]
+
+
+def _calories(rows):
+    # per-class counts and calorie estimate, same rules as the Streamlit app (one unit per detection)
+    items = {}
+    for cls in rows[:, 0].astype(int).tolist():
+        if cls not in items:
+            info = get_calorie_info(cls)
+            items[cls] = {"class": cls, "label": info["label"], "count": 0, "cal": info["cal"], "unit": info["unit"]}
+        items[cls]["count"] += 1
+    return {"total": sum(i["cal"] * i["count"] for i in items.values()), "items": list(items.values())}
+
+
+def _render_jpeg(img, preds, conf, names):
+    # img may be a decoded PIL image or the raw upload bytes (decoded here, off the request path)
+    if isinstance(img, (bytes, bytearray)):
+        img = _decode(img)
+    boxes, scores, classes = preds
+    t0 = time.perf_counter()
+    annotated = STATE["detect"].draw_boxes_pil(img.copy(), boxes, scores, classes, names, conf)
+    buf = io.BytesIO()
+    annotated.save(buf, format="JPEG", quality=90)
+    STAGE_SECONDS.observe(time.perf_counter() - t0, "annotation")
+    return buf.getvalue()
+
+
+def _save_run(name, img, preds, conf, names):
+    detect = STATE["detect"]
+    out_dir = os.path.join(YOLOV12_DIR, "runs", "serve", uuid.uuid4().hex)
+    boxes, scores, classes = preds
+    detect.save_result(out_dir, name, img, boxes, scores, classes, names, conf)
+
+
+def _response_format(accept):
+    # "json" | "msgpack" | "packed" from an Accept header, honouring q-values; JSON unless something else is preferred
+    choices = []
+    for i, part in enumerate((accept or "").split(",")):
+        media, *params = [p.strip() for p in part.split(";")]
+        q = 1.0
+        for param in params:
+            if param.startswith("q="):
+                try:
+                    q = float(param[2:])
+                except ValueError:
+                    q = 0.0
+        if q > 0:  # q=0 means "not acceptable"
+            choices.append((-q, i, media.lower()))
+    for _, _, media in sorted(choices):
+        if media in ("application/msgpack", "application/x-msgpack") and msgpack is not None:
+            return "msgpack"
+        if media in ("application/vnd.foodcal.f32", "application/octet-stream"):
+            return "packed"
+        if media in ("application/json", "application/*", "*/*"):
+            return "json"
+    return "json"
+
+
+def _json_response(body, headers=None, status_code=200):
+    if orjson is not None:
+        return Response(orjson.dumps(body), status_code=status_code, headers=headers, media_type="application/json")
+    return JSONResponse(body, status_code=status_code, headers=headers)
+
+
+def _error_body(error, exc):
+    body = {"ok": False, "error": error, "detail": str(exc)}
+    if DEBUG:
+        body["stdout"] = ""
+        body["stderr"] = repr(exc)
+    return body
+
+
+def _overload_response(exc):
+    if isinstance(exc, Rejected):
+        return JSONResponse({"ok": False, "error": exc.error, "retry_after": exc.retry_after}, status_code=exc.status,
+                            headers={"Retry-After": str(exc.retry_after)})
+    if isinstance(exc, QueueFull):
+        return JSONResponse({"ok": False, "error": "queue_full", "retry_after": 1}, status_code=503, headers={"Retry-After": "1"})
+    return JSONResponse({"ok": False, "error": "deadline_exceeded"}, status_code=504)
+
+
+async def _read_upload(request, max_bytes):
+    # (fields, files, None) or (None, None, error response)
+    try:
+        with STAGE_SECONDS.time("upload_read"):
+            fields, files = await read_form(request, max_bytes)
+    except UploadTooLarge as e:
+        return None, None, JSONResponse({"ok": False, "error": "upload_too_large", "max_bytes": e.limit}, status_code=413)
+    except BadUpload as e:
+        return None, None, JSONResponse({"ok": False, "error": "invalid_upload", "detail": str(e)}, status_code=400)
+    return fields, files, None
+
+
+def _imgsz(value):
+    # client imgsz -> multiple of the stride; ValueError outside [IMGSZ_MIN, IMGSZ_MAX]
+    imgsz = int(value)
+    if not IMGSZ_MIN <= imgsz <= IMGSZ_MAX:
+        raise ValueError(f"imgsz must be between {IMGSZ_MIN} and {IMGSZ_MAX}")
+    return -(-imgsz // IMGSZ_STRIDE) * IMGSZ_STRIDE
+
+
+def _conf(value):
+    # client conf clamped to [CONF_MIN, 1]
+    conf = float(value)
+    return min(1.0, conf) if conf >= CONF_MIN else CONF_MIN
+
+
+def _params(fields):
+    # form fields -> (conf, imgsz, model name); ValueError on malformed or out-of-range numbers
+    conf = _conf(fields["conf"]) if fields.get("conf") else CONF_DEFAULT
+    imgsz = _imgsz(fields["imgsz"]) if fields.get("imgsz") else IMGSZ_DEFAULT
+    return conf, imgsz, fields.get("model") or DEFAULT_MODEL
+
+
+def _decode(data):
+    # decode from the in-memory upload buffer (io.BytesIO makes one copy of a bytearray; nothing touches disk)
+    with STAGE_SECONDS.time("decode"):
+        return Image.open(io.BytesIO(data)).convert("RGB")
+
+
+class TooManyImages(Exception):
+    pass
+
+
+def _check_archive_limits(members, images, nbytes, max_images, max_bytes):
+    if images > max_images or members > ARCHIVE_MAX_MEMBERS:
+        raise TooManyImages()
+    if nbytes > max_bytes:
+        raise UploadTooLarge(max_bytes)
+
+
+def _archive_members(name, data, max_images, max_bytes):
+    # (member name, bytes) for every image inside a zip or tar archive, or None for a plain file. Member counts and
+    # uncompressed sizes of every member, images or not, come from the archive index and are checked before any
+    # data is extracted, so a small upload can't expand (or make us decompress) past the limits
+    # (TooManyImages / UploadTooLarge). Runs in _archive_pool.
+    lname = name.lower()
+    if lname.endswith(".zip"):
+        with zipfile.ZipFile(io.BytesIO(data)) as zf:
+            infos = zf.infolist()
+            members = [m for m in infos if not m.is_dir() and m.filename.lower().endswith(IMAGE_SUFFIXES)]
+            _check_archive_limits(len(infos), len(members), sum(m.file_size for m in infos), max_images, max_bytes)
+            return [(Path(m.filename).name, zf.read(m)) for m in members]
+    if lname.endswith((".tar", ".tar.gz", ".tgz")):
+        with tarfile.open(fileobj=io.BytesIO(data), mode="r:*") as tf:
+            members, count, total = [], 0, 0
+            # headers only; a member is charged before the stream is advanced past its data, so an oversized
+            # member of any kind is rejected without being decompressed
+            for m in tf:
+                count += 1
+                total += m.size
+                if m.isfile() and m.name.lower().endswith(IMAGE_SUFFIXES):
+                    members.append(m)
+                _check_archive_limits(count, len(members), total, max_images, max_bytes)
+            return [(Path(m.name).name, tf.extractfile(m).read()) for m in members]
+    return None
+
 
 @app.get("/healthz")
 def healthz():
-    return {"ok": True, "model_exists": Path(MODEL_PATH).exists()}
+    # liveness only: answers as soon as the process serves HTTP, whatever the model is doing
+    return {"ok": True, "model_exists": Path(MODEL_PATH).exists(), "model_loaded": registry.peek(DEFAULT_MODEL) is not None}
+
+@app.get("/readyz")
+def readyz():
+    # readiness: 200 once the default model is loaded and warmed, 503 while starting or after a failed start
+    startup = STATE["startup"]
+    ready = startup["phase"] == "ready"
+    body = {"ok": ready, "startup": startup}
+    if STATE["error"] is not None:
+        body["error"] = STATE["error"]
+    return JSONResponse(body, status_code=200 if ready else 503)
+
+@app.get("/metrics")
+def metrics():
+    return PlainTextResponse(METRICS.render(), media_type="text/plain; version=0.0.4")
+
+@app.get("/stats")
+def stats():
+    return {"ok": True, "admission": admission.stats(), "batcher": batcher.stats(), "cache": cache.stats(),
+            "single_flight": inflight.stats(), "image_store": images.stats(), "models": registry.stats()}
+
+@app.post("/admin/reload")
+async def admin_reload(model: Optional[str] = Form(None), x_admin_token: Optional[str] = Header(None)):
+    if not ADMIN_TOKEN or x_admin_token != ADMIN_TOKEN:
+        return JSONResponse({"ok": False, "error": "forbidden"}, status_code=403)
+    name = model or DEFAULT_MODEL
+    if name not in registry.specs:
+        return JSONResponse({"ok": False, "error": "unknown_model", "model": name, "available": registry.names()}, status_code=400)
+    if STATE["detect"] is None:
+        return JSONResponse(STATE["error"] or {"ok": False, "error": "model_not_loaded"}, status_code=500)
+    # load + warm in the background; the switch happens once the new weights are ready
+    task = asyncio.get_running_loop().create_task(_reload(name))
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+    return JSONResponse({"ok": True, "model": name, "status": "reloading"}, status_code=202)
+
+@app.get("/images/{token}")
+async def get_image(token: str):
+    entry = images.get(token)
+    if entry is None:
+        return JSONResponse({"ok": False, "error": "image_not_found"}, status_code=404)
+    jpeg, data, preds, conf, names = entry
+    if jpeg is None:
+        jpeg = await run_in_threadpool(_render_jpeg, data, preds, conf, names)
+        images.put(token, (jpeg, None, None, conf, names), len(jpeg))
+    return Response(content=jpeg, media_type="image/jpeg")
+
+async def _infer(data, detector, imgsz, conf, deadline):
+    # decode + batched inference for one upload under admission control -> (img, preds, detection rows)
+    async with admission.admit(deadline):
+        try:
+            img = await asyncio.get_running_loop().run_in_executor(_decode_pool, _decode, data)
+        except Exception as e:
+            raise BadUpload(str(e))
+        preds = await batcher.submit((detector, imgsz), (img, conf), deadline=deadline, lane="interactive")
+        return img, preds, _detection_rows(preds, img.size, conf)
+
+
+async def _with_upload_budget(request, max_bytes, handler, *args):
+    # hold a reservation for the request body (its Content-Length, else max_bytes) from before it is read until
+    # the response is ready, so concurrent uploads can't buffer more than MAX_UPLOAD_BUFFER_BYTES between them
+    length = request.headers.get("content-length")
+    nbytes = min(int(length), max_bytes) if length and length.isdigit() else max_bytes
+    try:
+        admission.reserve_upload(nbytes)
+    except Rejected as e:
+        return _overload_response(e)
+    try:
+        return await handler(request, *args)
+    finally:
+        admission.release_upload(nbytes)
+
 
 @app.post("/detect")
-async def detect(file: UploadFile = File(...), conf: Optional[float] = Form(None)):
-    conf_val = conf if conf is not None else CONF_DEFAULT
+async def detect(request: Request, background_tasks: BackgroundTasks):
+    # multipart form: file (required), conf, imgsz, return_image (none|inline|ref), model;
+    # the response format follows the Accept header (see PACKED_HEADER above)
+    return await _with_upload_budget(request, MAX_UPLOAD_BYTES, _detect, background_tasks)
 
-    # Save file to temp
-    tmpdir = tempfile.mkdtemp()
-    img_path = Path(tmpdir) / file.filename
-    with open(img_path, "wb") as f:
-        f.write(await file.read())
 
-    # Ensure yolov12 directory and detect.py exist
-    yolodir = Path(YOLOV12_DIR)
-    detect_py = yolodir / "detect.py"
-    if not yolodir.exists() or not detect_py.exists():
-        return JSONResponse({"ok": False, "error": "yolov12_not_found", "path": str(YOLOV12_DIR)}, status_code=500)
-    if not Path(MODEL_PATH).exists():
-        return JSONResponse({"ok": False, "error": "model_not_found", "model_path": MODEL_PATH}, status_code=500)
-
-    # Build command using python from environment
-    python_exec = sys.executable
-    cmd = [
-        python_exec,
-        str(detect_py),
-        "--weights", str(MODEL_PATH),
-        "--source", str(img_path),
-        "--conf", str(conf_val),
-        "--save-txt",
-        "--save-img"
-    ]
-
-    # Run detect inside yolov12 directory so outputs go to yolov12/runs/detect/...
-    proc = subprocess.run(cmd, capture_output=True, text=True, cwd=str(yolodir), env=os.environ.copy())
-    stdout = proc.stdout
-    stderr = proc.stderr
-
-    if proc.returncode != 0:
-        return JSONResponse({"ok": False, "error": "detect_failed", "stdout": stdout, "stderr": stderr}, status_code=500)
-
-    # find latest runs/detect/exp*
-    runs = sorted(glob.glob(str(yolodir / "runs" / "detect" / "exp*")))
-    if not runs:
-        return JSONResponse({"ok": False, "error": "no_runs"}, status_code=500)
-    latest = Path(runs[-1])
-
-    annotated_img_path = latest / img_path.name
-    label_file = latest / "labels" / (img_path.stem + ".txt")
-
-    annotated_b64 = None
-    if annotated_img_path.exists():
-        with open(annotated_img_path, "rb") as f:
-            annotated_b64 = base64.b64encode(f.read()).decode("utf-8")
-
-    # parse labels (YOLO text format) to list
-    detections = []
-    if label_file.exists():
-        with open(label_file) as f:
-            for line in f:
-                parts = line.strip().split()
-                if len(parts) >= 5:
-                    cls = int(float(parts[0]))
-                    x_center = float(parts[1]); y_center = float(parts[2])
-                    w = float(parts[3]); h = float(parts[4])
-                    confs = float(parts[5]) if len(parts) > 5 else None
-                    detections.append({"class": cls, "x": x_center, "y": y_center, "w": w, "h": h, "conf": confs})
-
-    return {"ok": True, "stdout": stdout, "stderr": stderr, "annotated_image_b64": annotated_b64, "detections": detections}
+async def _detect(request, background_tasks):
+    # reject before reading the upload when we already know we can't serve it in time
+    deadline = parse_deadline(request.headers)
+    try:
+        admission.check(deadline)
+    except (Rejected, DeadlineExceeded) as e:
+        return _overload_response(e)
+
+    fields, files, err = await _read_upload(request, MAX_UPLOAD_BYTES)
+    if err is not None:
+        return err
+    upload = next((f for f in files if f.name == "file"), None)
+    if upload is None:
+        return JSONResponse({"ok": False, "error": "missing_file", "field": "file"}, status_code=422)
+    try:
+        conf_val, imgsz_val, model_name = _params(fields)
+    except ValueError as e:
+        return JSONResponse({"ok": False, "error": "invalid_field", "detail": str(e)}, status_code=422)
+    return_image = fields.get("return_image") or RETURN_IMAGE_DEFAULT
+    if return_image not in RETURN_IMAGE_MODES:
+        return JSONResponse({"ok": False, "error": "invalid_return_image", "allowed": list(RETURN_IMAGE_MODES)}, status_code=400)
+    fmt = _response_format(request.headers.get("accept"))
+    if fmt == "packed" and return_image == "inline":
+        return_image = "none"  # the packed format has no room for an image; use return_image=ref to get one
+
+    detector, err = await _get_detector(model_name)
+    if err is not None:
+        return err
+
+    try:
+        data = upload.data
+        cache_key = make_key(data, conf_val, imgsz_val, detector.version)
+        cached = cache.get(cache_key)
+        img, shared = None, False
+        if cached is not None:
+            preds, rows, jpeg = cached
+        try:
+            if cached is None:
+                (img, preds, rows), shared = await inflight.do(
+                    cache_key, lambda: _infer(data, detector, imgsz_val, conf_val, deadline), deadline=deadline)
+                jpeg = None
+            if return_image == "inline" and jpeg is None:
+                jpeg = await run_in_threadpool(_render_jpeg, img if img is not None else data, preds, conf_val, detector.names)
+        except BadUpload as e:
+            return JSONResponse({"ok": False, "error": "invalid_image", "detail": str(e)}, status_code=400)
+        except (Rejected, DeadlineExceeded, QueueFull) as e:
+            return _overload_response(e)
+        except Exception as e:
+            return JSONResponse(_error_body("detect_failed", e), status_code=500)
+
+        # the request that ran inference stores the result; a hit that had to render upgrades the entry with its JPEG
+        if (cached is None and not shared) or (cached is not None and cached[2] is None and jpeg is not None):
+            cache.put(cache_key, (preds, rows, jpeg), len(jpeg or b"") + rows.nbytes + 64)
+        if img is not None and not shared and SAVE_RUNS:
+            name = Path(upload.filename or "image.jpg").name
+            background_tasks.add_task(_save_run, name, img, preds, conf_val, detector.names)
+
+        with STAGE_SECONDS.time("calorie_aggregation"):
+            calories = _calories(rows)
+        headers = {"X-Cache": "HIT" if cached is not None else "SHARED" if shared else "MISS"}
+        # only encode the annotated image when the client wants it inline; "ref" defers it to GET /images/{token}
+        image_url = None
+        if return_image == "ref":
+            token = uuid.uuid4().hex
+            images.put(token, (jpeg, None if jpeg else data, preds, conf_val, detector.names), len(jpeg or data))
+            image_url = f"/images/{token}"
+
+        with STAGE_SECONDS.time("serialization"):
+            if fmt == "packed":
+                if image_url:
+                    headers["X-Annotated-Image-Url"] = image_url
+                body = PACKED_HEADER.pack(PACKED_MAGIC, 1, 6, len(rows), calories["total"]) + rows.astype("<f4").tobytes()
+                return Response(body, headers=headers, media_type="application/vnd.foodcal.f32")
+            if fmt == "msgpack":
+                body = {"ok": True, "columns": ["class", "x", "y", "w", "h", "conf"], "detections": rows.tolist(),
+                        "calories": calories, "annotated_image": jpeg if return_image == "inline" else None}
+                if image_url:
+                    body["annotated_image_url"] = image_url
+                return Response(msgpack.packb(body), headers=headers, media_type="application/msgpack")
+
+            body = {"ok": True, "annotated_image_b64": None, "detections": _detections(rows), "calories": calories}
+            if return_image == "inline":
+                body["annotated_image_b64"] = base64.b64encode(jpeg).decode("utf-8")
+            elif image_url:
+                body["annotated_image_url"] = image_url
+            if DEBUG:
+                body["stdout"] = f"Processed {upload.filename}: {len(rows)} detections (model {model_name}@{detector.version}, imgsz {imgsz_val})"
+                body["stderr"] = ""
+            return _json_response(body, headers=headers)
+    finally:
+        registry.release(detector)
+
+@app.post("/detect/batch")
+async def detect_batch(request: Request):
+    # multipart form: files (one or more images and/or zip/tar archives), conf, imgsz, model
+    return await _with_upload_budget(request, BULK_MAX_UPLOAD_BYTES, _detect_batch)
+
+
+async def _detect_batch(request):
+    deadline = parse_deadline(request.headers)
+    try:
+        admission.check(deadline)
+    except (Rejected, DeadlineExceeded) as e:
+        return _overload_response(e)
+
+    fields, files, err = await _read_upload(request, BULK_MAX_UPLOAD_BYTES)
+    if err is not None:
+        return err
+    if not files:
+        return JSONResponse({"ok": False, "error": "missing_file", "field": "files"}, status_code=422)
+    try:
+        conf_val, imgsz_val, model_name = _params(fields)
+    except ValueError as e:
+        return JSONResponse({"ok": False, "error": "invalid_field", "detail": str(e)}, status_code=422)
+
+    detector, err = await _get_detector(model_name)
+    if err is not None:
+        return err
+
+    try:
+        # gather (name, bytes); archives are expanded in memory, off the event loop, within the image count and
+        # BULK_MAX_UPLOAD_BYTES of expanded data
+        loop = asyncio.get_running_loop()
+        inputs, expanded = [], 0
+        for f in files:
+            name = Path(f.filename or "image.jpg").name
+            data = f.data
+            try:
+                members = await loop.run_in_executor(_archive_pool, _archive_members, name, data,
+                                                     BULK_MAX_IMAGES - len(inputs), BULK_MAX_UPLOAD_BYTES - expanded)
+            except (zipfile.BadZipFile, tarfile.TarError) as e:
+                return JSONResponse({"ok": False, "error": "invalid_archive", "name": name, "detail": str(e)}, status_code=400)
+            except TooManyImages:
+                return JSONResponse({"ok": False, "error": "too_many_images", "max_images": BULK_MAX_IMAGES}, status_code=413)
+            except UploadTooLarge:
+                return JSONResponse({"ok": False, "error": "upload_too_large", "max_bytes": BULK_MAX_UPLOAD_BYTES}, status_code=413)
+            members = members if members is not None else [(name, data)]
+            inputs.extend(members)
+            expanded += sum(len(d) for _, d in members)
+            if len(inputs) > BULK_MAX_IMAGES:
+                return JSONResponse({"ok": False, "error": "too_many_images", "max_images": BULK_MAX_IMAGES}, status_code=413)
+
+        # decode in parallel
+        decoded = await asyncio.gather(*[loop.run_in_executor(_decode_pool, _decode, data) for _, data in inputs],
+                                       return_exceptions=True)
+
+        results = [None] * len(inputs)
+        ok_idx = []
+        for i, ((name, _), img) in enumerate(zip(inputs, decoded)):
+            if isinstance(img, Exception):
+                results[i] = {"name": name, "ok": False, "error": "invalid_image", "detail": str(img)}
+            else:
+                ok_idx.append(i)
+
+        # submitted to the bulk lane BULK_BATCH_SIZE images at a time, so interactive requests keep their share of the
+        # model between chunks; admission is charged per image
+        try:
+            async with admission.admit(deadline, cost=max(1, len(ok_idx))):
+                for start in range(0, len(ok_idx), BULK_BATCH_SIZE):
+                    if deadline is not None and time.monotonic() > deadline:
+                        raise DeadlineExceeded()
+                    chunk = ok_idx[start:start + BULK_BATCH_SIZE]
+                    preds = await asyncio.gather(*[batcher.submit((detector, imgsz_val), (decoded[i], conf_val),
+                                                                  deadline=deadline, lane="bulk") for i in chunk])
+                    for i, p in zip(chunk, preds):
+                        rows = _detection_rows(p, decoded[i].size, conf_val)
+                        results[i] = {"name": inputs[i][0], "ok": True, "detections": _detections(rows), "calories": _calories(rows)}
+        except (Rejected, DeadlineExceeded, QueueFull) as e:
+            return _overload_response(e)
+        except Exception as e:
+            return JSONResponse(_error_body("detect_failed", e), status_code=500)
+
+        return _json_response({"ok": True, "count": len(results), "results": results})
+    finally:
+        registry.release(detector)
+
+def _ws_rows(rows):
+    # compact rows: [class, x, y, w, h, conf], same convention as /detect
+    return [[int(r[0])] + r[1:] for r in rows.round(4).tolist()]
+
+@app.websocket("/ws/detect")
+async def ws_detect(websocket: WebSocket):
+    # Binary messages are JPEG/PNG frames; text messages are JSON settings ({"conf", "imgsz", "model"}).
+    # When frames arrive faster than inference, only the newest waiting frame is processed (latest frame wins).
+    # Frames go through admission and the interactive batcher lane like /detect uploads.
+    if STATE.get("ws_sessions", 0) >= WS_MAX_SESSIONS:
+        await websocket.close(code=1013)  # try again later
+        return
+    STATE["ws_sessions"] = STATE.get("ws_sessions", 0) + 1
+    params = {"conf": CONF_DEFAULT, "imgsz": IMGSZ_DEFAULT, "model": DEFAULT_MODEL}
+    slot = {"frame": None, "seq": 0, "dropped": 0}
+    ready = asyncio.Event()
+
+    async def receive():
+        try:
+            while True:
+                msg = await websocket.receive()
+                if msg["type"] == "websocket.disconnect":
+                    return
+                if msg.get("bytes") is not None:
+                    if slot["frame"] is not None:
+                        slot["dropped"] += 1
+                        WS_FRAMES.inc("dropped")
+                    slot["frame"] = msg["bytes"]
+                    slot["seq"] += 1
+                    ready.set()
+                elif msg.get("text"):
+                    try:
+                        update = json.loads(msg["text"])
+                        params.update({"conf": _conf(update.get("conf", params["conf"])),
+                                       "imgsz": _imgsz(update.get("imgsz", params["imgsz"])),
+                                       "model": str(update.get("model", params["model"]))})
+                    except (ValueError, TypeError, AttributeError):
+                        pass
+        finally:
+            ready.set()
+
+    receiver = None
+    try:
+        await websocket.accept()
+        receiver = asyncio.get_running_loop().create_task(receive())
+        while True:
+            await ready.wait()
+            ready.clear()
+            frame, seq = slot["frame"], slot["seq"]
+            slot["frame"] = None
+            if frame is None:
+                if receiver.done():
+                    break
+                continue
+            detector, err = await _get_detector(params["model"])
+            if err is not None:
+                await websocket.send_text(err.body.decode("utf-8"))
+                continue
+            t0 = time.perf_counter()
+            try:
+                img, _, rows = await _infer(frame, detector, params["imgsz"], params["conf"], None)
+            except (Rejected, DeadlineExceeded, QueueFull) as e:
+                WS_FRAMES.inc("rejected")
+                await websocket.send_json({**json.loads(_overload_response(e).body), "frame": seq})
+                continue
+            except Exception as e:
+                WS_FRAMES.inc("error")
+                await websocket.send_json({"ok": False, "frame": seq, "error": "invalid_frame", "detail": str(e)})
+                continue
+            finally:
+                registry.release(detector)
+            WS_FRAMES.inc("processed")
+            await websocket.send_json({"ok": True, "frame": seq, "size": img.size, "dropped": slot["dropped"],
+                                       "latency_ms": round((time.perf_counter() - t0) * 1000.0, 2),
+                                       "detections": _ws_rows(rows)})
+    except WebSocketDisconnect:
+        pass
+    finally:
+        if receiver is not None:
+            receiver.cancel()
+        STATE["ws_sessions"] -= 1
 
 if __name__ == "__main__":
     uvicorn.run(app, host="0.0.0.0", port=int(os.environ.get("PORT", 10000)))
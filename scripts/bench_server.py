@@ -0,0 +1,417 @@
+#!/usr/bin/env python3
+# Load test for inference_server.py: starts the server locally (by default on a tiny stand-in ONNX model),
+# replays an image corpus in closed-loop and/or fixed-RPS mode, and reports latency percentiles, throughput,
+# server CPU and RSS. Results are written as JSON so runs on different commits can be compared:
+#
+#   python scripts/bench_server.py --mode closed open --concurrency 1 8 --rps 10 40 --out bench/results/HEAD.json
+#   python scripts/bench_server.py --compare bench/results/old.json bench/results/HEAD.json
+#
+# Only the standard library is needed for the client; the stand-in model needs onnx (to write it) and onnxruntime.
+import argparse
+import http.client
+import io
+import json
+import os
+import platform
+import queue
+import random
+import socket
+import subprocess
+import sys
+import threading
+import time
+import uuid
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+IMAGE_SUFFIXES = ('.jpg', '.jpeg', '.png', '.bmp', '.webp')
+
+
+def make_standin_model(path, nc=13, anchors=8400, seed=0):
+    # Tiny ONNX model with the raw YOLO head contract (images -> (b, 4 + nc, anchors)). A strided conv over the
+    # whole input gives it real, size-dependent compute; the output is a fixed head with a few boxes, so
+    # decode + NMS see a realistic anchor count.
+    import numpy as np
+    import onnx
+    from onnx import TensorProto, helper, numpy_helper
+
+    rng = np.random.default_rng(seed)
+    head = np.zeros((1, 4 + nc, anchors), np.float32)
+    head[0, :4] = rng.uniform(8, 600, (4, anchors))
+    for i in range(12):
+        head[0, :4, i] = [rng.uniform(100, 540), rng.uniform(100, 540), rng.uniform(40, 160), rng.uniform(40, 160)]
+        head[0, 4 + i % nc, i] = rng.uniform(0.3, 0.95)
+    nodes = [
+        helper.make_node('Conv', ['images', 'w'], ['f'], strides=[2, 2], pads=[1, 1, 1, 1]),
+        helper.make_node('ReduceMean', ['f'], ['m'], axes=[1, 2, 3], keepdims=0),
+        helper.make_node('Mul', ['m', 'zero'], ['z']),
+        helper.make_node('Reshape', ['z', 'shape'], ['z3']),
+        helper.make_node('Add', ['z3', 'head'], ['output0']),
+    ]
+    graph = helper.make_graph(
+        nodes, 'standin',
+        [helper.make_tensor_value_info('images', TensorProto.FLOAT, ['batch', 3, 'height', 'width'])],
+        [helper.make_tensor_value_info('output0', TensorProto.FLOAT, ['batch', 4 + nc, anchors])],
+        [numpy_helper.from_array(rng.normal(0, 0.1, (16, 3, 3, 3)).astype(np.float32), 'w'),
+         numpy_helper.from_array(np.array(0, np.float32), 'zero'),
+         numpy_helper.from_array(np.array([-1, 1, 1], np.int64), 'shape'),
+         numpy_helper.from_array(head, 'head')])
+    model = helper.make_model(graph, opset_imports=[helper.make_opsetid('', 13)], ir_version=8)
+    model.metadata_props.add(key='names', value=str({i: f'class{i}' for i in range(nc)}))
+    Path(path).parent.mkdir(parents=True, exist_ok=True)
+    onnx.save(model, str(path))
+    return str(path)
+
+
+def load_corpus(corpus, synthetic, seed=0):
+    # list of (name, jpeg bytes): every image file under `corpus`, else `synthetic` random JPEGs of varied sizes
+    if corpus:
+        files = sorted(p for p in Path(corpus).rglob('*') if p.suffix.lower() in IMAGE_SUFFIXES)
+        if not files:
+            raise SystemExit(f'no images under {corpus}')
+        return [(p.name, p.read_bytes()) for p in files]
+    import numpy as np
+    from PIL import Image
+    rng = np.random.default_rng(seed)
+    images = []
+    for i in range(synthetic):
+        w, h = int(rng.integers(320, 1280)), int(rng.integers(240, 960))
+        buf = io.BytesIO()
+        Image.fromarray(rng.integers(0, 255, (h, w, 3), dtype=np.uint8)).save(buf, format='JPEG', quality=85)
+        images.append((f'synthetic{i}.jpg', buf.getvalue()))
+    return images
+
+
+def multipart(name, data, fields):
+    boundary = uuid.uuid4().hex
+    parts = [f'--{boundary}\r\nContent-Disposition: form-data; name="{k}"\r\n\r\n{v}\r\n'.encode() for k, v in fields.items()]
+    parts.append(f'--{boundary}\r\nContent-Disposition: form-data; name="file"; filename="{name}"\r\n'
+                 f'Content-Type: image/jpeg\r\n\r\n'.encode() + data + b'\r\n')
+    parts.append(f'--{boundary}--\r\n'.encode())
+    return b''.join(parts), f'multipart/form-data; boundary={boundary}'
+
+
+class Client:
+    # one keep-alive connection per thread
+    def __init__(self, host, port, path, headers):
+        self.host, self.port, self.path, self.headers = host, port, path, headers
+        self._local = threading.local()
+
+    def post(self, body, content_type):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._local.conn = http.client.HTTPConnection(self.host, self.port, timeout=120)
+        try:
+            conn.request('POST', self.path, body=body, headers={**self.headers, 'Content-Type': content_type})
+            resp = conn.getresponse()
+            resp.read()
+            return resp.status
+        except (OSError, http.client.HTTPException):
+            conn.close()
+            self._local.conn = None
+            return 0
+
+
+class ProcessSampler:
+    # CPU seconds and RSS of the server and its children (inference workers), from /proc or psutil
+    def __init__(self, pid, interval=0.25):
+        self.pid, self.interval = pid, interval
+        self.rss = []
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _pids(self):
+        pids = [self.pid]
+        try:
+            for entry in os.listdir('/proc'):
+                if entry.isdigit():
+                    with open(f'/proc/{entry}/stat') as f:
+                        if int(f.read().rsplit(')', 1)[1].split()[1]) == self.pid:
+                            pids.append(int(entry))
+        except OSError:
+            pass
+        return pids
+
+    def snapshot(self):
+        # -> (cpu seconds, rss bytes) summed over the process tree
+        try:
+            import psutil
+            procs = [psutil.Process(self.pid)]
+            procs += procs[0].children(recursive=True)
+            cpu = sum(sum(p.cpu_times()[:2]) for p in procs)
+            return cpu, sum(p.memory_info().rss for p in procs)
+        except ImportError:
+            pass
+        except Exception:
+            return 0.0, 0
+        cpu, rss, tick, page = 0.0, 0, os.sysconf('SC_CLK_TCK'), os.sysconf('SC_PAGE_SIZE')
+        for pid in self._pids():
+            try:
+                with open(f'/proc/{pid}/stat') as f:
+                    fields = f.read().rsplit(')', 1)[1].split()
+                cpu += (int(fields[11]) + int(fields[12])) / tick
+                with open(f'/proc/{pid}/statm') as f:
+                    rss += int(f.read().split()[1]) * page
+            except OSError:
+                pass
+        return cpu, rss
+
+    def start(self):
+        self.cpu0, _ = self.snapshot()
+        self.t0 = time.perf_counter()
+
+        def run():
+            while not self._stop.wait(self.interval):
+                self.rss.append(self.snapshot()[1])
+
+        self._thread = threading.Thread(target=run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        cpu1, rss = self.snapshot()
+        self.rss.append(rss)
+        wall = time.perf_counter() - self.t0
+        return {'cpu_percent': round(100.0 * (cpu1 - self.cpu0) / wall, 1) if wall else 0.0,
+                'rss_mb_max': round(max(self.rss) / 2 ** 20, 1), 'rss_mb_mean': round(sum(self.rss) / len(self.rss) / 2 ** 20, 1)}
+
+
+def percentile(sorted_values, q):
+    if not sorted_values:
+        return None
+    return sorted_values[min(len(sorted_values) - 1, int(q / 100.0 * len(sorted_values)))]
+
+
+def summarize(mode, level, samples, wall, usage):
+    # samples: list of (latency seconds, status)
+    lat = sorted(s[0] * 1000.0 for s in samples)
+    statuses = {}
+    for _, status in samples:
+        statuses[str(status)] = statuses.get(str(status), 0) + 1
+    ok = sum(v for k, v in statuses.items() if k.startswith('2'))
+    return {
+        'mode': mode, 'level': level, 'requests': len(samples), 'ok': ok, 'errors': len(samples) - ok,
+        'statuses': statuses, 'duration_s': round(wall, 3), 'throughput_rps': round(ok / wall, 2) if wall else 0.0,
+        'latency_ms': {'p50': percentile(lat, 50), 'p95': percentile(lat, 95), 'p99': percentile(lat, 99),
+                       'mean': sum(lat) / len(lat) if lat else None, 'max': lat[-1] if lat else None},
+        **usage,
+    }
+
+
+def run_closed(client, bodies, concurrency, duration):
+    # `concurrency` users, each sending the next request as soon as the previous one returns
+    samples, lock = [], threading.Lock()
+    end = time.perf_counter() + duration
+
+    def user(seed):
+        rng = random.Random(seed)
+        while time.perf_counter() < end:
+            body, ctype = rng.choice(bodies)
+            t0 = time.perf_counter()
+            status = client.post(body, ctype)
+            with lock:
+                samples.append((time.perf_counter() - t0, status))
+
+    threads = [threading.Thread(target=user, args=(i,)) for i in range(concurrency)]
+    t0 = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return samples, time.perf_counter() - t0
+
+
+def run_open(client, bodies, rps, duration, max_threads=256):
+    # fixed arrival rate; latency counts from the scheduled send time, so a slow server cannot hide queueing
+    # delay by slowing the client down (no coordinated omission)
+    samples, lock = [], threading.Lock()
+    todo = queue.Queue()
+    rng = random.Random(0)
+
+    def sender():
+        while True:
+            job = todo.get()
+            if job is None:
+                return
+            scheduled, (body, ctype) = job
+            delay = scheduled - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            status = client.post(body, ctype)
+            with lock:
+                samples.append((time.perf_counter() - scheduled, status))
+
+    n = int(rps * duration)
+    threads = [threading.Thread(target=sender) for _ in range(min(max_threads, max(1, n)))]
+    for t in threads:
+        t.start()
+    t0 = time.perf_counter()
+    for i in range(n):
+        todo.put((t0 + i / rps, rng.choice(bodies)))
+    for _ in threads:
+        todo.put(None)
+    for t in threads:
+        t.join()
+    return samples, time.perf_counter() - t0
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def start_server(port, weights, env_overrides, log_path):
+    env = {**os.environ, 'MODEL_PATH': str(weights), 'YOLOV12_DIR': str(ROOT / 'yolov12'), 'PORT': str(port),
+           'MODEL_WATCH_INTERVAL_S': '0', 'RUNS_PRUNE_INTERVAL_S': '0', 'CACHE_MAX_ENTRIES': '0', **env_overrides}
+    log = open(log_path, 'wb')
+    proc = subprocess.Popen([sys.executable, '-m', 'uvicorn', 'inference_server:app', '--host', '127.0.0.1',
+                             '--port', str(port), '--workers', '1', '--log-level', 'warning'],
+                            cwd=str(ROOT), env=env, stdout=log, stderr=subprocess.STDOUT)
+    deadline = time.time() + 300
+    while time.time() < deadline:
+        if proc.poll() is not None:
+            raise SystemExit(f'server exited with {proc.returncode}; see {log_path}')
+        try:
+            conn = http.client.HTTPConnection('127.0.0.1', port, timeout=2)
+            conn.request('GET', '/readyz')
+            resp = conn.getresponse()
+            body = json.loads(resp.read() or b'{}')
+            if resp.status == 200:
+                return proc, body.get('startup', {})
+            if body.get('startup', {}).get('phase') == 'failed':
+                proc.terminate()
+                raise SystemExit(f'server failed to start: {body.get("error")}')
+        except (OSError, ValueError, http.client.HTTPException):
+            pass
+        time.sleep(0.2)
+    proc.terminate()
+    raise SystemExit('server did not become ready within 300s')
+
+
+def git_commit():
+    try:
+        sha = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True, text=True).stdout.strip()
+        dirty = subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], cwd=ROOT, capture_output=True, text=True).stdout.strip()
+        return sha + ('-dirty' if dirty else '') if sha else None
+    except OSError:
+        return None
+
+
+def compare(old_path, new_path, threshold=0.10):
+    # print per-scenario deltas; exit status 1 when any p95 or throughput regresses by more than `threshold`
+    old, new = json.loads(Path(old_path).read_text()), json.loads(Path(new_path).read_text())
+    base = {(r['mode'], r['level']): r for r in old['results']}
+    print(f"{'scenario':<16}{'p50 ms':>20}{'p95 ms':>20}{'p99 ms':>20}{'rps':>22}{'rss MB':>22}")
+    regressed = False
+    for r in new['results']:
+        o = base.get((r['mode'], r['level']))
+        if o is None:
+            continue
+
+        def cell(a, b):
+            if a is None or b is None:
+                return 'n/a'
+            return f'{a:.1f}->{b:.1f} ({(b - a) / a * 100 if a else 0:+.0f}%)'
+
+        lo, ln = o['latency_ms'], r['latency_ms']
+        print(f"{r['mode'] + ' ' + str(r['level']):<16}{cell(lo['p50'], ln['p50']):>20}{cell(lo['p95'], ln['p95']):>20}"
+              f"{cell(lo['p99'], ln['p99']):>20}{cell(o['throughput_rps'], r['throughput_rps']):>22}"
+              f"{cell(o['rss_mb_max'], r['rss_mb_max']):>22}")
+        if lo['p95'] and ln['p95'] and ln['p95'] > lo['p95'] * (1 + threshold):
+            regressed = True
+        if o['throughput_rps'] and r['throughput_rps'] < o['throughput_rps'] * (1 - threshold):
+            regressed = True
+    print(f"{old.get('meta', {}).get('commit')} -> {new.get('meta', {}).get('commit')}: "
+          f"{'REGRESSION' if regressed else 'ok'} (threshold {threshold:.0%})")
+    return 1 if regressed else 0
+
+
+def parse_args():
+    p = argparse.ArgumentParser(description='Load-test the inference server and record latency, throughput, CPU and RSS.')
+    p.add_argument('--weights', help='model to serve (default: generate a tiny stand-in ONNX model)')
+    p.add_argument('--corpus', help='directory of images to replay (default: synthetic JPEGs)')
+    p.add_argument('--synthetic', type=int, default=32, help='number of synthetic images when no corpus is given')
+    p.add_argument('--mode', nargs='*', default=['closed', 'open'], choices=['closed', 'open'])
+    p.add_argument('--concurrency', nargs='+', type=int, default=[1, 4, 16], help='closed-loop users per scenario')
+    p.add_argument('--rps', nargs='+', type=float, default=[5, 20], help='arrival rates for fixed-RPS scenarios')
+    p.add_argument('--duration', type=float, default=15.0, help='seconds per scenario')
+    p.add_argument('--warmup', type=float, default=3.0, help='seconds of closed-loop traffic before measuring')
+    p.add_argument('--endpoint', default='/detect')
+    p.add_argument('--accept', default='application/json')
+    p.add_argument('--return-image', default='none', choices=['none', 'inline', 'ref'])
+    p.add_argument('--conf', type=float, default=0.25)
+    p.add_argument('--env', action='append', default=[], metavar='KEY=VALUE', help='extra server environment')
+    p.add_argument('--url', help='benchmark an already running server (host:port) instead of starting one')
+    p.add_argument('--out', help='JSON results path (default: bench/results/<commit>.json)')
+    p.add_argument('--compare', nargs=2, metavar=('OLD', 'NEW'), help='compare two result files and exit')
+    p.add_argument('--threshold', type=float, default=0.10, help='relative regression threshold for --compare')
+    return p.parse_args()
+
+
+def main():
+    args = parse_args()
+    if args.compare:
+        sys.exit(compare(*args.compare, threshold=args.threshold))
+
+    commit = git_commit()
+    bench_dir = ROOT / 'bench'
+    images = load_corpus(args.corpus, args.synthetic)
+    fields = {'conf': str(args.conf), 'return_image': args.return_image}
+    bodies = [multipart(name, data, fields) for name, data in images]
+
+    proc, startup = None, {}
+    if args.url:
+        host, _, port = args.url.rpartition(':')
+        port = int(port)
+    else:
+        weights = args.weights or make_standin_model(bench_dir / 'standin.onnx')
+        host, port = '127.0.0.1', free_port()
+        env = dict(kv.split('=', 1) for kv in args.env)
+        proc, startup = start_server(port, weights, env, bench_dir / 'server.log')
+        print(f'server ready on :{port} ({startup})')
+    client = Client(host, port, args.endpoint, {'Accept': args.accept})
+    sampler = ProcessSampler(proc.pid) if proc is not None else None
+
+    results = []
+    try:
+        if args.warmup > 0:
+            run_closed(client, bodies, 2, args.warmup)
+        scenarios = [('closed', c) for c in args.concurrency if 'closed' in args.mode]
+        scenarios += [('open', r) for r in args.rps if 'open' in args.mode]
+        for mode, level in scenarios:
+            if sampler is not None:
+                sampler = ProcessSampler(proc.pid)
+                sampler.start()
+            if mode == 'closed':
+                samples, wall = run_closed(client, bodies, int(level), args.duration)
+            else:
+                samples, wall = run_open(client, bodies, float(level), args.duration)
+            usage = sampler.stop() if sampler is not None else {}
+            r = summarize(mode, level, samples, wall, usage)
+            results.append(r)
+            lat = r['latency_ms']
+            print(f"{mode:>6} {level:>6}: {r['throughput_rps']:7.2f} rps  p50 {lat['p50'] or 0:8.1f}  p95 {lat['p95'] or 0:8.1f}  "
+                  f"p99 {lat['p99'] or 0:8.1f} ms  errors {r['errors']}  cpu {r.get('cpu_percent', '-')}%  "
+                  f"rss {r.get('rss_mb_max', '-')} MB")
+    finally:
+        if proc is not None:
+            proc.terminate()
+            proc.wait(timeout=30)
+
+    report = {
+        'meta': {'commit': commit, 'time': time.strftime('%Y-%m-%dT%H:%M:%S%z'), 'python': platform.python_version(),
+                 'platform': platform.platform(), 'cpus': os.cpu_count(), 'weights': args.weights or 'standin.onnx',
+                 'corpus': args.corpus or f'synthetic:{args.synthetic}', 'endpoint': args.endpoint, 'accept': args.accept,
+                 'return_image': args.return_image, 'duration_s': args.duration, 'env': args.env, 'startup': startup},
+        'results': results,
+    }
+    out = Path(args.out) if args.out else bench_dir / 'results' / f'{commit or "unknown"}.json'
+    out.parent.mkdir(parents=True, exist_ok=True)
+    out.write_text(json.dumps(report, indent=2))
+    print(f'results written to {out}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,135 @@
+# src/admission.py
+# Admission control for the inference server: bounds in-flight and pending work and rejects early
+# (429 queue full / 503 overloaded, with Retry-After) when the estimated queue wait exceeds the deadline.
+# Upload buffers are budgeted too: every request reserves its largest possible body before it is read.
+import asyncio
+import math
+import time
+from contextlib import asynccontextmanager
+
+
+class Rejected(Exception):
+    def __init__(self, status, error, retry_after):
+        super().__init__(error)
+        self.status = status
+        self.error = error
+        self.retry_after = retry_after
+
+
+class DeadlineExceeded(Exception):
+    pass
+
+
+def parse_deadline(headers, now=None):
+    # absolute monotonic deadline from X-Request-Deadline (unix epoch seconds) or X-Request-Timeout-Ms, else None
+    now = time.monotonic() if now is None else now
+    try:
+        if headers.get("x-request-timeout-ms"):
+            return now + float(headers["x-request-timeout-ms"]) / 1000.0
+        if headers.get("x-request-deadline"):
+            return now + (float(headers["x-request-deadline"]) - time.time())
+    except ValueError:
+        pass
+    return None
+
+
+class AdmissionController:
+    def __init__(self, max_inflight=16, max_pending=64, max_wait_s=30.0, ewma_alpha=0.2, max_upload_bytes=None):
+        self.max_inflight = max(1, int(max_inflight))
+        self.max_upload_bytes = max_upload_bytes  # None: unbounded
+        self.upload_bytes = 0  # reserved by requests whose body is buffered (or being read)
+        self.max_pending = int(max_pending)
+        self.max_wait_s = float(max_wait_s)
+        self.alpha = float(ewma_alpha)
+        self._sem = None
+        self.inflight = 0
+        self.pending = 0
+        self.queued_cost = 0  # images waiting or running, for the wait estimate
+        self.unit_seconds = 0.0  # EWMA of service time per image
+        self.admitted = 0
+        self.rejected = {}
+        self.expired = 0
+
+    def estimated_wait(self):
+        return self.queued_cost * self.unit_seconds / self.max_inflight
+
+    def _reject(self, status, error, wait):
+        self.rejected[error] = self.rejected.get(error, 0) + 1
+        raise Rejected(status, error, max(1, math.ceil(wait)))
+
+    def check(self, deadline=None, cost=1):
+        # cheap early check before reading the upload; raises Rejected without reserving anything
+        if self.pending >= self.max_pending:
+            self._reject(429, "queue_full", self.estimated_wait() or 1)
+        wait = self.estimated_wait() + cost * self.unit_seconds / self.max_inflight
+        budget = self.max_wait_s
+        if deadline is not None:
+            budget = min(budget, deadline - time.monotonic())
+        if budget <= 0:
+            self.expired += 1
+            raise DeadlineExceeded()
+        if wait > budget:
+            self._reject(503, "overloaded", wait)
+
+    def reserve_upload(self, nbytes):
+        # reserve buffer space for an upload of up to nbytes -> release with release_upload(nbytes);
+        # 503 "uploads_busy" when it would pass max_upload_bytes (one upload is always let through)
+        if self.max_upload_bytes is not None and self.upload_bytes and self.upload_bytes + nbytes > self.max_upload_bytes:
+            self._reject(503, "uploads_busy", 1)
+        self.upload_bytes += nbytes
+        return nbytes
+
+    def release_upload(self, nbytes):
+        self.upload_bytes -= nbytes
+
+    @asynccontextmanager
+    async def admit(self, deadline=None, cost=1):
+        self.check(deadline, cost)
+        if self._sem is None:
+            self._sem = asyncio.Semaphore(self.max_inflight)
+        self.pending += 1
+        self.queued_cost += cost
+        try:
+            timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+            try:
+                await asyncio.wait_for(self._sem.acquire(), timeout)
+            except asyncio.TimeoutError:
+                self.expired += 1
+                raise DeadlineExceeded()
+        except BaseException:
+            self.queued_cost -= cost
+            raise
+        finally:
+            self.pending -= 1
+
+        self.inflight += 1
+        self.admitted += 1
+        t0 = time.perf_counter()
+        ok = False
+        try:
+            yield
+            ok = True
+        finally:
+            self.inflight -= 1
+            self.queued_cost -= cost
+            self._sem.release()
+            if ok:
+                per_unit = (time.perf_counter() - t0) / cost
+                self.unit_seconds = per_unit if not self.unit_seconds else (
+                    self.alpha * per_unit + (1 - self.alpha) * self.unit_seconds)
+
+    def stats(self):
+        return {
+            "max_inflight": self.max_inflight,
+            "max_pending": self.max_pending,
+            "max_wait_s": self.max_wait_s,
+            "inflight": self.inflight,
+            "pending": self.pending,
+            "estimated_wait_s": self.estimated_wait(),
+            "upload_bytes": self.upload_bytes,
+            "max_upload_bytes": self.max_upload_bytes,
+            "ewma_seconds_per_image": self.unit_seconds,
+            "admitted": self.admitted,
+            "rejected": dict(self.rejected),
+            "expired": self.expired,
+        }
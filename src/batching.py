@@ -0,0 +1,248 @@
+# src/batching.py
+# Dynamic micro-batching for the inference server.
+# Requests are queued, collected for up to max_wait_ms (or until max_batch_size is reached),
+# grouped by key (e.g. imgsz) and run as one forward pass; results are fanned back to each caller.
+# Requests go to priority lanes (e.g. interactive and bulk) with separate queues, served by weighted fair
+# dequeuing; the first lane can carry a p95 latency target that throttles the others while it is missed.
+import asyncio
+import time
+from collections import Counter, deque
+
+from .admission import DeadlineExceeded
+
+
+class QueueFull(Exception):
+    pass
+
+
+class _Lane:
+    def __init__(self, name, weight, max_batch_size, max_queue, window_s=10.0):
+        self.name = name
+        self.weight = max(1, int(weight))
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.limit = self.max_batch_size  # current batch size cap; lowered while the first lane misses its target
+        self.max_queue = int(max_queue)
+        self.queue = deque()
+        self.current = 0  # smooth weighted round-robin state
+        self.running = 0
+        self.items = 0
+        self.window_s = window_s
+        self.latencies = deque(maxlen=512)  # (finished at, enqueue -> result seconds)
+
+    def p95(self):
+        cutoff = time.perf_counter() - self.window_s
+        while self.latencies and self.latencies[0][0] < cutoff:
+            self.latencies.popleft()
+        if not self.latencies:
+            return 0.0
+        ordered = sorted(lat for _, lat in self.latencies)
+        return ordered[min(len(ordered) - 1, int(0.95 * len(ordered)))]
+
+
+class MicroBatcher:
+    def __init__(self, run_batch, max_batch_size=8, max_wait_ms=10.0, max_queue=256, max_concurrency=1,
+                 lanes=(("default", 1, None),), p95_target_ms=None):
+        # run_batch(key, items) -> list of results, same length/order as items; called in a worker thread.
+        # max_concurrency > 1 keeps several batches in flight (for backends that run them in parallel).
+        # lanes: (name, weight, max_batch_size or None) in priority order; submit() defaults to the first one.
+        self.run_batch = run_batch
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_wait = max(0.0, float(max_wait_ms)) / 1000.0
+        self.max_queue = int(max_queue)
+        self.max_concurrency = max(1, int(max_concurrency))
+        self.lanes = {name: _Lane(name, weight, size or self.max_batch_size, self.max_queue) for name, weight, size in lanes}
+        self._first = next(iter(self.lanes.values()))
+        self.p95_target = float(p95_target_ms) / 1000.0 if p95_target_ms else None
+        self._arrived = None
+        self._task = None
+        self._slots = None
+        self._running = set()
+        # metrics
+        self.batches = 0
+        self.items = 0
+        self.errors = 0
+        self.rejected = 0
+        self.expired = 0
+        self.batch_sizes = Counter()
+        self.queue_wait_total = 0.0
+        self.queue_wait_max = 0.0
+        self.max_depth_seen = 0
+
+    def start(self):
+        if self._task is None:
+            self._arrived = asyncio.Event()
+            self._slots = asyncio.Semaphore(self.max_concurrency)
+            self._task = asyncio.get_running_loop().create_task(self._worker())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        for task in list(self._running):
+            task.cancel()
+
+    @property
+    def depth(self):
+        return sum(len(lane.queue) for lane in self.lanes.values())
+
+    async def submit(self, key, item, deadline=None, lane=None):
+        # deadline: time.monotonic() value after which the caller no longer wants the result
+        lane = self._first if lane is None else self.lanes[lane]
+        if len(lane.queue) >= lane.max_queue:
+            self.rejected += 1
+            raise QueueFull()
+        fut = asyncio.get_running_loop().create_future()
+        lane.queue.append((key, item, fut, time.perf_counter(), deadline))
+        self.max_depth_seen = max(self.max_depth_seen, self.depth)
+        self._arrived.set()
+        return await fut
+
+    def throttled(self):
+        # the first lane is missing its latency target
+        return self.p95_target is not None and self._first.p95() > self.p95_target
+
+    def _pick(self):
+        # smooth weighted round-robin over lanes with queued work. While the first lane misses its target it is
+        # served strictly first; and when several batches can run at once, lower lanes never take the last free
+        # slot, so a first-lane request never waits behind a full set of lower-lane batches.
+        reserve = self.max_concurrency > 1
+        eligible = [lane for lane in self.lanes.values() if lane.queue and (
+            lane is self._first or not reserve or lane.running < self.max_concurrency - 1)]
+        if self._first in eligible and self.throttled():
+            eligible = [self._first]
+        if not eligible:
+            return None
+        total = sum(lane.weight for lane in eligible)
+        for lane in eligible:
+            lane.current += lane.weight
+        best = max(eligible, key=lambda lane: lane.current)
+        best.current -= total
+        return best
+
+    async def _next_lane(self):
+        while True:
+            lane = self._pick()
+            if lane is not None:
+                return lane
+            self._arrived.clear()
+            await self._arrived.wait()
+
+    async def _collect(self, lane):
+        pending = [lane.queue.popleft()]
+        # only the first lane waits for company; lower lanes take what is already queued and go
+        deadline = time.perf_counter() + (self.max_wait if lane is self._first else 0.0)
+        while len(pending) < lane.limit:
+            if lane.queue:
+                pending.append(lane.queue.popleft())
+                continue
+            timeout = deadline - time.perf_counter()
+            if timeout <= 0:
+                break
+            self._arrived.clear()
+            try:
+                await asyncio.wait_for(self._arrived.wait(), timeout)
+            except asyncio.TimeoutError:
+                break
+        return pending
+
+    async def _worker(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            # while every slot is busy, new requests keep queueing and form the next, larger batch
+            await self._slots.acquire()
+            try:
+                lane = await self._next_lane()
+                pending = await self._collect(lane)
+            except BaseException:
+                self._slots.release()
+                raise
+            groups = {}
+            for entry in pending:
+                groups.setdefault(entry[0], []).append(entry)
+
+            for i, (key, entries) in enumerate(groups.items()):
+                if i:
+                    await self._slots.acquire()
+                lane.running += 1
+                task = loop.create_task(self._dispatch(lane, key, entries))
+                self._running.add(task)
+                task.add_done_callback(self._running.discard)
+
+    async def _dispatch(self, lane, key, entries):
+        try:
+            # callers that already gave up (cancelled or past their deadline) don't need a forward pass
+            now = time.monotonic()
+            for e in entries:
+                if e[4] is not None and e[4] < now and not e[2].done():
+                    e[2].set_exception(DeadlineExceeded())
+                    self.expired += 1
+            entries = [e for e in entries if not e[2].done()]
+            if not entries:
+                return
+            now = time.perf_counter()
+            for e in entries:
+                waited = now - e[3]
+                self.queue_wait_total += waited
+                self.queue_wait_max = max(self.queue_wait_max, waited)
+            self.batches += 1
+            self.items += len(entries)
+            lane.items += len(entries)
+            self.batch_sizes[len(entries)] += 1
+            try:
+                results = await asyncio.get_running_loop().run_in_executor(None, self.run_batch, key, [e[1] for e in entries])
+            except Exception as exc:
+                self.errors += 1
+                for e in entries:
+                    if not e[2].done():
+                        e[2].set_exception(exc)
+                return
+            done = time.perf_counter()
+            for e, res in zip(entries, results):
+                lane.latencies.append((done, done - e[3]))
+                if not e[2].done():
+                    e[2].set_result(res)
+            self._adjust_limits()
+        finally:
+            lane.running -= 1
+            self._slots.release()
+            self._arrived.set()  # a lane may have become eligible again
+
+    def _adjust_limits(self):
+        # AIMD on the lower lanes' batch size: halve it while the first lane has work and misses its p95 target,
+        # grow it back one image per batch once the target is met or the first lane is idle
+        if self.p95_target is None:
+            return
+        busy = bool(self._first.queue) or self._first.running > 0
+        missed = busy and self.throttled()
+        for lane in self.lanes.values():
+            if lane is not self._first:
+                lane.limit = max(1, lane.limit // 2) if missed else min(lane.max_batch_size, lane.limit + 1)
+
+    def stats(self):
+        return {
+            "max_batch_size": self.max_batch_size,
+            "max_wait_ms": self.max_wait * 1000.0,
+            "max_queue": self.max_queue,
+            "max_concurrency": self.max_concurrency,
+            "running_batches": len(self._running),
+            "queue_depth": self.depth,
+            "max_queue_depth_seen": self.max_depth_seen,
+            "batches": self.batches,
+            "items": self.items,
+            "errors": self.errors,
+            "rejected": self.rejected,
+            "expired": self.expired,
+            "avg_batch_size": (self.items / self.batches) if self.batches else 0.0,
+            "batch_size_counts": {str(k): v for k, v in sorted(self.batch_sizes.items())},
+            "avg_queue_wait_ms": (self.queue_wait_total / self.items * 1000.0) if self.items else 0.0,
+            "max_queue_wait_ms": self.queue_wait_max * 1000.0,
+            "p95_target_ms": self.p95_target * 1000.0 if self.p95_target is not None else None,
+            "throttled": self.throttled(),
+            "lanes": {name: {"weight": lane.weight, "queue_depth": len(lane.queue), "running": lane.running,
+                             "items": lane.items, "batch_size_limit": lane.limit, "p95_ms": lane.p95() * 1000.0}
+                      for name, lane in self.lanes.items()},
+        }
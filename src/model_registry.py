@@ -0,0 +1,208 @@
+# src/model_registry.py
+# Registry of named models for the inference server.
+# Models load lazily on first use (concurrent requests for the same model share one load),
+# and least-recently-used models are evicted once the memory budget or model count is exceeded.
+# Callers that acquire() a model hold it until release(); a model dropped by eviction or reload is handed to
+# on_evict(name, model) (e.g. to stop its worker processes) only once its last user has released it.
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+
+
+class UnknownModel(KeyError):
+    pass
+
+
+def parse_model_specs(text):
+    # "food=/models/best.pt,yolov12n=yolov12n.pt" -> {"food": "/models/best.pt", "yolov12n": "yolov12n.pt"}
+    specs = {}
+    for part in (text or "").split(","):
+        part = part.strip()
+        if not part:
+            continue
+        name, _, path = part.partition("=")
+        specs[name.strip()] = path.strip() or name.strip()
+    return specs
+
+
+class ModelRegistry:
+    def __init__(self, loader, specs, pinned=(), max_bytes=2 * 1024 ** 3, max_models=3, on_evict=None):
+        # loader(path) -> model object exposing .nbytes
+        self.loader = loader
+        self.on_evict = on_evict
+        self.specs = dict(specs)
+        self.pinned = set(pinned)
+        self.max_bytes = int(max_bytes)
+        self.max_models = int(max_models)
+        self._models = OrderedDict()  # name -> model, least recently used first
+        self._loading = {}  # name -> Future shared by every caller waiting on that load
+        self._reloading = {}  # name -> Future for an in-progress hot reload
+        self._users = {}  # id(model) -> [model, number of acquire() calls not yet released]
+        self._retired = {}  # id(model) -> name, for dropped models that still have users
+        self._lock = threading.Lock()
+        self.loads = 0
+        self.load_errors = 0
+        self.evictions = 0
+        self.reloads = 0
+        self.reload_errors = 0
+        self.last_reload_error = None
+        self.load_seconds = {}
+
+    def names(self):
+        return list(self.specs)
+
+    def peek(self, name):
+        # loaded model or None, without triggering a load
+        with self._lock:
+            model = self._models.get(name)
+            if model is not None:
+                self._models.move_to_end(name)
+            return model
+
+    def acquire(self, name, load=True):
+        # get() (or peek() when load is False) that also counts the caller as a user until release(model)
+        while True:
+            model = self.get(name) if load else self.peek(name)
+            if model is None:
+                return None
+            with self._lock:
+                if self._models.get(name) is model:  # not dropped between the lookup and here
+                    self._users.setdefault(id(model), [model, 0])[1] += 1
+                    return model
+
+    def release(self, model):
+        with self._lock:
+            entry = self._users[id(model)]
+            entry[1] -= 1
+            if entry[1] > 0:
+                return
+            del self._users[id(model)]
+            name = self._retired.pop(id(model), None)
+        if name is not None:
+            self._notify([(name, model)])
+
+    def get(self, name):
+        if name not in self.specs:
+            raise UnknownModel(name)
+        with self._lock:
+            model = self._models.get(name)
+            if model is not None:
+                self._models.move_to_end(name)
+                return model
+            fut = self._loading.get(name)
+            owner = fut is None
+            if owner:
+                fut = self._loading[name] = Future()
+        if not owner:
+            return fut.result()
+
+        t0 = time.perf_counter()
+        try:
+            model = self.loader(self.specs[name])
+        except BaseException as e:
+            with self._lock:
+                del self._loading[name]
+                self.load_errors += 1
+            fut.set_exception(e)
+            raise
+        with self._lock:
+            self._models[name] = model
+            del self._loading[name]
+            self.loads += 1
+            self.load_seconds[name] = time.perf_counter() - t0
+            dropped = self._evict(keep=name)
+        fut.set_result(model)
+        self._notify(dropped)
+        return model
+
+    def reload(self, name):
+        # Load a fresh copy next to the current model, then swap it in under the lock.
+        # Requests that already hold the old model finish on it; new requests get the new one.
+        if name not in self.specs:
+            raise UnknownModel(name)
+        with self._lock:
+            fut = self._reloading.get(name)
+            owner = fut is None
+            if owner:
+                fut = self._reloading[name] = Future()
+        if not owner:
+            return fut.result()
+
+        t0 = time.perf_counter()
+        try:
+            model = self.loader(self.specs[name])
+        except BaseException as e:
+            with self._lock:
+                del self._reloading[name]
+                self.reload_errors += 1
+                self.last_reload_error = f"{name}: {e!r}"
+            fut.set_exception(e)
+            raise
+        with self._lock:
+            old = self._models.get(name)
+            self._models[name] = model
+            self._models.move_to_end(name)
+            del self._reloading[name]
+            self.reloads += 1
+            self.load_seconds[name] = time.perf_counter() - t0
+            dropped = self._evict(keep=name)
+            if old is not None:
+                dropped += self._retire(name, old)
+        fut.set_result(model)
+        self._notify(dropped)
+        return model
+
+    def _evict(self, keep):
+        # caller holds the lock; -> [(name, model)] dropped models that have no users left
+        def over():
+            total = sum(getattr(m, "nbytes", 0) for m in self._models.values())
+            return len(self._models) > self.max_models or total > self.max_bytes
+
+        dropped = []
+        for name in list(self._models):
+            if not over():
+                break
+            if name == keep or name in self.pinned:
+                continue
+            dropped += self._retire(name, self._models.pop(name))
+            self.evictions += 1
+        return dropped
+
+    def _retire(self, name, model):
+        # caller holds the lock; a model still in use waits in _retired for its last release()
+        if id(model) in self._users:
+            self._retired[id(model)] = name
+            return []
+        return [(name, model)]
+
+    def _notify(self, dropped):
+        # called without the lock held
+        if self.on_evict is not None:
+            for name, model in dropped:
+                self.on_evict(name, model)
+
+    def stats(self):
+        with self._lock:
+            loaded = {name: {"version": getattr(m, "version", None), "nbytes": getattr(m, "nbytes", 0)}
+                      for name, m in self._models.items()}
+            loading = list(self._loading)
+            reloading = list(self._reloading)
+            retired = sorted(self._retired.values())
+        return {
+            "available": self.names(),
+            "loaded": loaded,
+            "loading": loading,
+            "reloading": reloading,
+            "retired": retired,
+            "bytes": sum(v["nbytes"] for v in loaded.values()),
+            "max_bytes": self.max_bytes,
+            "max_models": self.max_models,
+            "loads": self.loads,
+            "load_errors": self.load_errors,
+            "evictions": self.evictions,
+            "reloads": self.reloads,
+            "reload_errors": self.reload_errors,
+            "last_reload_error": self.last_reload_error,
+            "load_seconds": dict(self.load_seconds),
+        }
@@ -0,0 +1,89 @@
+# src/retention.py
+# Bounded disk usage for run outputs and temp uploads: prune() keeps the children of a directory within a
+# maximum count, total size and age, deleting oldest first. Used by the inference server (periodically)
+# and the Streamlit app (after each run), always off the request path.
+import os
+import shutil
+import threading
+import time
+
+_prune_lock = threading.Lock()
+
+
+def _size(path):
+    if not os.path.isdir(path):
+        return os.path.getsize(path)
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass
+    return total
+
+
+def prune(root, max_count=None, max_bytes=None, max_age_s=None, min_age_s=60.0, now=None):
+    # -> {"removed", "freed_bytes", "kept", "kept_bytes"} (sizes are only measured when max_bytes is set).
+    # Entries touched in the last min_age_s are never removed (a run may still be writing or being read),
+    # and dotfiles such as the exp counter are left alone.
+    now = time.time() if now is None else now
+    entries = []
+    try:
+        with os.scandir(root) as it:
+            for e in it:
+                if e.name.startswith("."):
+                    continue
+                try:
+                    entries.append([e.stat().st_mtime, e.path, None])
+                except OSError:
+                    pass
+    except FileNotFoundError:
+        return {"removed": 0, "freed_bytes": 0, "kept": 0, "kept_bytes": 0}
+    entries.sort()  # oldest first
+    if max_bytes is not None:
+        for entry in entries:
+            entry[2] = _size(entry[1])
+
+    removed = freed = 0
+    count = len(entries)
+    total = sum(e[2] or 0 for e in entries)
+    keep = []
+    for mtime, path, size in entries:
+        age = now - mtime
+        expendable = age >= min_age_s and (
+            (max_age_s is not None and age > max_age_s)
+            or (max_count is not None and count > max_count)
+            or (max_bytes is not None and total > max_bytes))
+        if not expendable:
+            keep.append(size or 0)
+            continue
+        if os.path.isdir(path) and not os.path.islink(path):
+            shutil.rmtree(path, ignore_errors=True)
+        else:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+        removed += 1
+        count -= 1
+        total -= size or 0
+        freed += size or 0
+    return {"removed": removed, "freed_bytes": freed, "kept": len(keep), "kept_bytes": sum(keep)}
+
+
+def prune_in_background(targets, **limits):
+    # prune each directory in a daemon thread; skipped if a previous prune is still running
+    if not _prune_lock.acquire(blocking=False):
+        return None
+
+    def _run():
+        try:
+            for root in targets:
+                prune(root, **limits)
+        finally:
+            _prune_lock.release()
+
+    thread = threading.Thread(target=_run, name="prune", daemon=True)
+    thread.start()
+    return thread
@@ -0,0 +1,62 @@
+# src/single_flight.py
+# Request coalescing for the inference server: concurrent calls with the same key (content hash + parameters)
+# share one execution, and every waiter gets the leader's result (or its exception). Failures that belong to the
+# leader's own request (its deadline, its admission) are not shared: a follower that hits one runs fn itself.
+import asyncio
+import time
+
+from .admission import DeadlineExceeded, Rejected
+
+
+class SingleFlight:
+    def __init__(self, retry_on=(DeadlineExceeded, Rejected)):
+        self._calls = {}  # key -> Future of the leader's result
+        self.retry_on = retry_on  # leader exceptions a follower retries as leader instead of sharing
+        self.leaders = 0
+        self.shared = 0  # requests answered from another request's execution
+        self.retried = 0  # followers that re-ran fn after a leader-specific failure
+
+    @property
+    def inflight(self):
+        return len(self._calls)
+
+    async def do(self, key, fn, deadline=None):
+        # -> (result of `await fn()`, shared); followers stop waiting at their own deadline (time.monotonic())
+        fut = self._calls.get(key)
+        if fut is not None:
+            timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+            try:
+                result = await asyncio.wait_for(asyncio.shield(fut), timeout)
+            except asyncio.TimeoutError:
+                raise DeadlineExceeded()
+            except asyncio.CancelledError:
+                if not fut.cancelled():
+                    raise
+                return await self.do(key, fn, deadline)  # the leader went away; run it ourselves
+            except self.retry_on:
+                # the leader ran out of its own time or was turned away; that says nothing about this caller
+                if deadline is not None and time.monotonic() >= deadline:
+                    raise DeadlineExceeded()
+                self.retried += 1
+                return await self.do(key, fn, deadline)
+            self.shared += 1
+            return result, True
+
+        fut = self._calls[key] = asyncio.get_running_loop().create_future()
+        fut.add_done_callback(lambda f: f.cancelled() or f.exception())  # no "exception never retrieved" warnings
+        self.leaders += 1
+        try:
+            result = await fn()
+        except asyncio.CancelledError:
+            fut.cancel()
+            raise
+        except BaseException as e:
+            fut.set_exception(e)
+            raise
+        finally:
+            del self._calls[key]
+        fut.set_result(result)
+        return result, False
+
+    def stats(self):
+        return {"inflight": self.inflight, "leaders": self.leaders, "shared": self.shared, "retried": self.retried}
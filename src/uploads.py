@@ -0,0 +1,93 @@
+# src/uploads.py
+# Streaming multipart/form-data reader for the inference server.
+# Parts are collected from request.stream() straight into in-memory buffers (no spooled temp files),
+# and the size limit is enforced while the body is still arriving rather than after it has been stored.
+try:
+    from python_multipart.multipart import MultipartParser, parse_options_header
+except ImportError:  # python-multipart < 0.0.13
+    from multipart.multipart import MultipartParser, parse_options_header
+
+
+class UploadTooLarge(Exception):
+    def __init__(self, limit):
+        super().__init__(f"upload exceeds {limit} bytes")
+        self.limit = limit
+
+
+class BadUpload(Exception):
+    pass
+
+
+class Part:
+    def __init__(self):
+        self.name = None
+        self.filename = None
+        self.content_type = None
+        self.data = bytearray()
+
+
+async def read_form(request, max_bytes, max_parts=1000):
+    # -> (fields {name: str}, files [Part]); raises UploadTooLarge / BadUpload
+    ctype, params = parse_options_header(request.headers.get("content-type", ""))
+    if ctype != b"multipart/form-data" or b"boundary" not in params:
+        raise BadUpload("expected multipart/form-data")
+    length = request.headers.get("content-length")
+    if length and length.isdigit() and int(length) > max_bytes:
+        raise UploadTooLarge(max_bytes)
+
+    parts = []
+    headers = {}
+    field, value = bytearray(), bytearray()
+
+    def on_part_begin():
+        if len(parts) >= max_parts:
+            raise BadUpload(f"more than {max_parts} parts")
+        parts.append(Part())
+        headers.clear()
+
+    def on_header_field(data, start, end):
+        field.extend(data[start:end])
+
+    def on_header_value(data, start, end):
+        value.extend(data[start:end])
+
+    def on_header_end():
+        headers[bytes(field).lower()] = bytes(value)
+        field.clear()
+        value.clear()
+
+    def on_headers_finished():
+        part = parts[-1]
+        _, options = parse_options_header(headers.get(b"content-disposition", b""))
+        part.name = options.get(b"name", b"").decode("utf-8", "replace")
+        if b"filename" in options:
+            part.filename = options[b"filename"].decode("utf-8", "replace")
+        part.content_type = headers.get(b"content-type", b"").decode("latin-1") or None
+
+    def on_part_data(data, start, end):
+        parts[-1].data.extend(data[start:end])
+
+    parser = MultipartParser(params[b"boundary"], {
+        "on_part_begin": on_part_begin,
+        "on_header_field": on_header_field,
+        "on_header_value": on_header_value,
+        "on_header_end": on_header_end,
+        "on_headers_finished": on_headers_finished,
+        "on_part_data": on_part_data,
+    })
+    received = 0
+    try:
+        async for chunk in request.stream():
+            received += len(chunk)
+            if received > max_bytes:
+                raise UploadTooLarge(max_bytes)
+            parser.write(chunk)
+        parser.finalize()
+    except (UploadTooLarge, BadUpload):
+        raise
+    except Exception as e:
+        raise BadUpload(str(e))
+
+    fields = {p.name: p.data.decode("utf-8", "replace") for p in parts if p.filename is None}
+    files = [p for p in parts if p.filename is not None]
+    return fields, files
@@ -0,0 +1,100 @@
+# src/worker_pool.py
+# Multi-process inference for the server: N worker processes, each pinned to its own slice of CPU cores.
+# Every worker loads the same fused weights file with torch.load(mmap=True) (detect.MappedDetector), so the
+# read-only weight pages are shared through the page cache and each extra worker only adds its activations.
+import multiprocessing as mp
+import os
+import sys
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+_detector = None  # per worker process
+
+
+def core_slices(workers, cores=None):
+    # split the CPUs this process may use into `workers` contiguous slices (one core each when oversubscribed)
+    cores = sorted(cores if cores is not None else (os.sched_getaffinity(0) if hasattr(os, "sched_getaffinity")
+                                                     else range(os.cpu_count() or 1)))
+    workers = max(1, int(workers))
+    if workers >= len(cores):
+        return [[cores[i % len(cores)]] for i in range(workers)]
+    size, extra = divmod(len(cores), workers)
+    slices, start = [], 0
+    for i in range(workers):
+        end = start + size + (1 if i < extra else 0)
+        slices.append(cores[start:end])
+        start = end
+    return slices
+
+
+def _init_worker(yolodir, path, slices, counter, conf, imgsz, warmup):
+    global _detector
+    with counter.get_lock():
+        index = counter.value
+        counter.value += 1
+    cores = slices[index % len(slices)]
+    if hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, cores)
+    # set before torch is imported so its OpenMP pool matches the pinned cores
+    os.environ["OMP_NUM_THREADS"] = str(len(cores))
+    if yolodir not in sys.path:
+        sys.path.insert(0, yolodir)
+    import detect
+    _detector = detect.MappedDetector(path, conf=conf, threads=len(cores))
+    if warmup:
+        _detector.warmup(imgsz=imgsz, conf=conf)
+
+
+def _info():
+    return _detector.names, _detector.version
+
+
+def _predict(arrays, conf, imgsz):
+    from PIL import Image
+    preds = _detector.predict([Image.fromarray(a) for a in arrays], conf=conf, imgsz=imgsz)
+    return preds, _detector.last_timings
+
+
+class WorkerPool:
+    # Same predict() contract as the detect.py detectors, but safe to call from several threads at once:
+    # each call is handed to whichever worker process is idle.
+    thread_safe = True
+
+    def __init__(self, yolodir, path, workers, conf=0.25, imgsz=640, warmup=True):
+        self.path = str(path)
+        slices = core_slices(workers)
+        self.workers = len(slices)
+        ctx = mp.get_context("spawn")  # never fork a process that already runs threads
+        self._pool = ProcessPoolExecutor(self.workers, mp_context=ctx, initializer=_init_worker,
+                                         initargs=(str(yolodir), self.path, slices, ctx.Value("i", 0), conf, imgsz, warmup))
+        self._local = threading.local()
+        # starting one task per worker brings the whole pool up before the first request
+        infos = [f.result() for f in [self._pool.submit(_info) for _ in range(self.workers)]]
+        self.names, self.version = infos[0]
+
+    @property
+    def nbytes(self):
+        # the weights are mapped once and shared by all workers
+        return os.path.getsize(self.path)
+
+    @property
+    def last_timings(self):
+        return getattr(self._local, "timings", {})
+
+    def predict(self, imgs, conf=0.25, imgsz=None):
+        preds, self._local.timings = self._pool.submit(_predict, [np.asarray(img) for img in imgs], conf, imgsz).result()
+        return preds
+
+    def warmup(self, imgsz=640, conf=0.25):
+        pass  # every worker warms itself up in _init_worker
+
+    def close(self):
+        self._pool.shutdown(wait=False, cancel_futures=True)
+
+    def __del__(self):
+        # the registry closes evicted and replaced pools; this only catches one that was dropped without close()
+        pool = getattr(self, "_pool", None)
+        if pool is not None:
+            pool.shutdown(wait=False)
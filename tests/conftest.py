@@ -0,0 +1,9 @@
+# pytest configuration for the server/app tests in tests/ (yolov12/tests is the vendored ultralytics suite).
+# Puts the repo root and yolov12/ on sys.path so tests can import src.* and detect; tests/ is deliberately not a package, since
+# yolov12/tests already owns the top-level name "tests".
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+sys.path.insert(0, str(ROOT / "yolov12"))
@@ -0,0 +1,110 @@
+import asyncio
+import time
+
+import pytest
+
+from src.admission import AdmissionController, DeadlineExceeded, Rejected, parse_deadline
+
+
+def test_queue_full_429():
+    """Test that requests beyond max_pending are rejected with 429 before reserving anything."""
+    ac = AdmissionController(max_inflight=1, max_pending=1)
+
+    async def main():
+        release = asyncio.Event()
+
+        async def hold():
+            async with ac.admit():
+                await release.wait()
+
+        tasks = [asyncio.create_task(hold()) for _ in range(2)]  # one in flight, one pending
+        await asyncio.sleep(0.01)
+        assert (ac.inflight, ac.pending) == (1, 1)
+        with pytest.raises(Rejected) as e:
+            ac.check()
+        release.set()
+        await asyncio.gather(*tasks)
+        return e.value
+
+    rejected = asyncio.run(main())
+    assert (rejected.status, rejected.error) == (429, "queue_full")
+    assert rejected.retry_after >= 1
+    assert ac.rejected == {"queue_full": 1} and ac.admitted == 2
+
+
+def test_overloaded_503_when_wait_exceeds_deadline():
+    """Test that the estimated queue wait is compared against the caller's deadline (and max_wait_s)."""
+    ac = AdmissionController(max_inflight=2, max_pending=100, max_wait_s=30)
+    ac.unit_seconds = 1.0
+    ac.queued_cost = 4  # ~2 s of queued work over 2 slots
+    with pytest.raises(Rejected) as e:
+        ac.check(deadline=time.monotonic() + 1.0)
+    assert (e.value.status, e.value.error) == (503, "overloaded")
+    assert e.value.retry_after == 3
+    ac.check(deadline=time.monotonic() + 10.0)  # enough budget
+    ac.max_wait_s = 1.0
+    with pytest.raises(Rejected):
+        ac.check()  # no deadline, but over max_wait_s
+
+
+def test_deadline_expired_504():
+    """Test that a passed deadline, or one that runs out while waiting for a slot, raises DeadlineExceeded."""
+    ac = AdmissionController(max_inflight=1, max_pending=10)
+    with pytest.raises(DeadlineExceeded):
+        ac.check(deadline=time.monotonic() - 0.01)
+
+    async def main():
+        release = asyncio.Event()
+
+        async def hold():
+            async with ac.admit():
+                await release.wait()
+
+        holder = asyncio.create_task(hold())
+        await asyncio.sleep(0.01)
+        with pytest.raises(DeadlineExceeded):
+            async with ac.admit(deadline=time.monotonic() + 0.05):
+                pass
+        release.set()
+        await holder
+
+    asyncio.run(main())
+    assert ac.expired == 2
+    assert (ac.inflight, ac.pending, ac.queued_cost) == (0, 0, 0)
+
+
+def test_service_time_ewma():
+    """Test that admitted work updates the per-image service time estimate."""
+    ac = AdmissionController(max_inflight=1)
+
+    async def main():
+        async with ac.admit(cost=2):
+            await asyncio.sleep(0.02)
+
+    asyncio.run(main())
+    assert 0.005 < ac.unit_seconds < 0.05
+
+
+def test_parse_deadline():
+    """Test the deadline headers."""
+    assert parse_deadline({}, now=100.0) is None
+    assert parse_deadline({"x-request-timeout-ms": "250"}, now=100.0) == pytest.approx(100.25)
+    assert parse_deadline({"x-request-timeout-ms": "soon"}, now=100.0) is None
+    deadline = parse_deadline({"x-request-deadline": str(time.time() + 2)}, now=100.0)
+    assert deadline == pytest.approx(102.0, abs=0.1)
+
+
+def test_upload_budget():
+    """Test that upload reservations past max_upload_bytes get 503, one upload always fits, and release frees space."""
+    ac = AdmissionController(max_upload_bytes=100)
+    ac.reserve_upload(500)  # a single oversized upload still gets through
+    with pytest.raises(Rejected) as e:
+        ac.reserve_upload(1)
+    assert (e.value.status, e.value.error) == (503, "uploads_busy")
+    ac.release_upload(500)
+    ac.reserve_upload(60)
+    ac.reserve_upload(40)
+    with pytest.raises(Rejected):
+        ac.reserve_upload(1)
+    ac.release_upload(40)
+    assert ac.stats()["upload_bytes"] == 60
@@ -0,0 +1,86 @@
+import asyncio
+import threading
+import time
+
+from src.batching import MicroBatcher
+
+
+def make_batcher(run_batch, **kwargs):
+    kwargs.setdefault("lanes", (("interactive", 4, None), ("bulk", 1, None)))
+    return MicroBatcher(run_batch, max_wait_ms=0, **kwargs)
+
+
+def test_bulk_flood_weighted_fair():
+    """Test that interactive items queued behind a bulk flood wait at most one bulk batch per 4 interactive ones."""
+    order = []
+
+    def run_batch(key, items):
+        order.extend(items)
+        return items
+
+    async def main():
+        b = make_batcher(run_batch, max_batch_size=1)
+        b.start()
+        bulk = [asyncio.create_task(b.submit("k", f"b{i}", lane="bulk")) for i in range(20)]
+        interactive = [asyncio.create_task(b.submit("k", f"i{i}", lane="interactive")) for i in range(8)]
+        await asyncio.gather(*bulk, *interactive)
+        await b.stop()
+
+    asyncio.run(main())
+    last = max(order.index(f"i{i}") for i in range(8))
+    assert sum(1 for item in order[:last] if item.startswith("b")) <= 2  # 8 interactive at weight 4:1
+    assert len(order) == 28
+
+
+def test_last_slot_reserved_for_interactive():
+    """Test that bulk batches never hold every slot, so an interactive item starts before the bulk backlog clears."""
+    lock = threading.Lock()
+    running = {"bulk": 0, "max_bulk": 0}
+    started = []
+
+    def run_batch(key, items):
+        is_bulk = items[0].startswith("b")
+        with lock:
+            started.append(items[0])
+            if is_bulk:
+                running["bulk"] += 1
+                running["max_bulk"] = max(running["max_bulk"], running["bulk"])
+        time.sleep(0.02)
+        with lock:
+            if is_bulk:
+                running["bulk"] -= 1
+        return items
+
+    async def main():
+        b = make_batcher(run_batch, max_batch_size=1, max_concurrency=2)
+        b.start()
+        bulk = [asyncio.create_task(b.submit("k", f"b{i}", lane="bulk")) for i in range(10)]
+        await asyncio.sleep(0.05)
+        await b.submit("k", "i0", lane="interactive")
+        await asyncio.gather(*bulk)
+        await b.stop()
+
+    asyncio.run(main())
+    assert running["max_bulk"] == 1
+    assert started.index("i0") < 6
+
+
+def test_bulk_limit_shrinks_while_target_missed():
+    """Test that the bulk batch size is halved after each interactive batch that misses the p95 target."""
+    def run_batch(key, items):
+        time.sleep(0.01)
+        return items
+
+    async def main():
+        b = make_batcher(run_batch, max_batch_size=16, lanes=(("interactive", 4, 1), ("bulk", 1, None)),
+                         p95_target_ms=1)
+        b.start()
+        limits = []
+        for i in range(3):
+            await b.submit("k", i, lane="interactive")
+            limits.append(b.lanes["bulk"].limit)
+        assert b.stats()["throttled"]
+        await b.stop()
+        return limits
+
+    assert asyncio.run(main()) == [8, 4, 2]
@@ -0,0 +1,125 @@
+import importlib.util
+import os
+from pathlib import Path
+
+import numpy as np
+import pytest
+from PIL import Image
+
+import detect
+
+ROOT = Path(__file__).resolve().parent.parent
+
+
+@pytest.fixture(scope="module")
+def standin_onnx(tmp_path_factory):
+    """Tiny ONNX model with the raw YOLO head contract, from the benchmark script."""
+    pytest.importorskip("onnx")
+    pytest.importorskip("onnxruntime")
+    spec = importlib.util.spec_from_file_location("bench_server", ROOT / "scripts" / "bench_server.py")
+    bench = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(bench)
+    return bench.make_standin_model(tmp_path_factory.mktemp("onnx") / "standin.onnx")
+
+
+@pytest.fixture(scope="module")
+def weights():
+    """Real YOLO weights for parity tests: FOODCAL_TEST_WEIGHTS, else yolo11n.pt (downloaded by ultralytics)."""
+    pytest.importorskip("ultralytics")
+    return os.environ.get("FOODCAL_TEST_WEIGHTS", "yolo11n.pt")
+
+
+@pytest.fixture(scope="module")
+def image():
+    """A real photo when ultralytics' assets are available, else a synthetic one."""
+    try:
+        from ultralytics.utils import ASSETS
+        return Image.open(ASSETS / "bus.jpg").convert("RGB")
+    except ImportError:
+        rng = np.random.default_rng(0)
+        return Image.fromarray(rng.integers(0, 255, (480, 640, 3), dtype=np.uint8))
+
+
+def box_iou(a, b):
+    """Pairwise IoU between two (N, 4) and (M, 4) xyxy arrays."""
+    lt = np.maximum(a[:, None, :2], b[None, :, :2])
+    rb = np.minimum(a[:, None, 2:], b[None, :, 2:])
+    inter = (rb - lt).clip(0).prod(2)
+    area_a = (a[:, 2:] - a[:, :2]).prod(1)
+    area_b = (b[:, 2:] - b[:, :2]).prod(1)
+    return inter / (area_a[:, None] + area_b[None] - inter)
+
+
+def test_postprocess_raw():
+    """Test raw head decoding: conf filter, class-aware NMS and letterbox undo."""
+    pred = np.zeros((4 + 3, 4), dtype=np.float32)
+    pred[:, 0] = [320, 320, 100, 100, 0.9, 0, 0]  # kept
+    pred[:, 1] = [322, 322, 100, 100, 0.8, 0, 0]  # same class, overlaps box 0 -> suppressed
+    pred[:, 2] = [322, 322, 100, 100, 0, 0.7, 0]  # other class, kept
+    pred[:, 3] = [100, 100, 10, 10, 0, 0, 0.1]  # below conf
+    boxes, scores, classes = detect.postprocess_raw(pred, 0.25, ratio=0.5, pad=(0, 160), img_size=(1280, 640))
+    assert scores.tolist() == pytest.approx([0.9, 0.7])
+    assert classes.tolist() == [0, 1]
+    assert boxes[0].tolist() == pytest.approx([540, 220, 740, 420])
+
+
+def test_nms_max_det():
+    """Test that NMS stops once max_det boxes are kept."""
+    boxes = np.array([[i * 20, 0, i * 20 + 10, 10] for i in range(50)], dtype=np.float32)
+    keep = detect.nms(boxes, np.linspace(1, 0.5, 50), max_det=7)
+    assert keep.tolist() == list(range(7))
+
+
+def test_onnx_standin(standin_onnx, image):
+    """Test the ONNX backend end to end: stride-rounded input shape, batching and postprocessing."""
+    det = detect.OnnxDetector(standin_onnx)
+    assert det.input_shape(600) == (608, 608)
+    assert det.input_shape(None) == (640, 640)
+    out = det.predict([image, image.resize((320, 240))], conf=0.25, imgsz=600)
+    assert len(out) == 2
+    for (boxes, scores, classes), img in zip(out, (image, image.resize((320, 240)))):
+        assert len(boxes) == len(scores) == len(classes) > 0
+        assert (scores >= 0.25).all()
+        assert (boxes[:, [0, 2]] <= img.size[0]).all() and (boxes[:, [1, 3]] <= img.size[1]).all()
+
+
+def test_onnx_parity(weights, image):
+    """Test that the ONNX Runtime backend matches the torch backend on the same image."""
+    pytest.importorskip("onnxruntime")
+    onnx_file = detect.export_onnx(weights, imgsz=640, dynamic=True)
+
+    tb, ts, tc = detect.Detector(weights).predict([image], conf=0.25, imgsz=640)[0]
+    ob, os_, oc = detect.OnnxDetector(onnx_file).predict([image], conf=0.25, imgsz=640)[0]
+
+    # letterbox padding differs slightly between the two paths, so match confident boxes by IoU
+    for boxes_a, scores_a, cls_a, boxes_b, cls_b in ((tb, ts, tc, ob, oc), (ob, os_, oc, tb, tc)):
+        strong = scores_a >= 0.5
+        iou = box_iou(boxes_a[strong], boxes_b) * (cls_a[strong][:, None] == cls_b[None])
+        assert (iou.max(1, initial=0) > 0.85).all()
+
+
+def test_iter_sources_glob_routes_videos(tmp_path, monkeypatch):
+    """Test that videos matched by a glob are decoded as videos rather than passed on as image paths."""
+    (tmp_path / "a.jpg").write_bytes(b"")
+    (tmp_path / "b.mp4").write_bytes(b"")
+    monkeypatch.setattr(detect, "iter_video", lambda path, stride=1: iter([(f"{path}:0", "frame")]))
+    names = [name for name, _ in detect.iter_sources(str(tmp_path / "*"))]
+    assert names == [str(tmp_path / "a.jpg"), f"{tmp_path / 'b.mp4'}:0"]
+
+
+def test_iter_detections_groups_by_image_size():
+    """Test that detectors without a fixed input shape only get batches of images with the same size."""
+    class RecordingDetector:
+        def __init__(self):
+            self.batches = []
+
+        def predict(self, imgs, conf=0.25, imgsz=None):
+            self.batches.append([img.size for img in imgs])
+            return [(np.zeros((0, 4)), np.zeros(0), np.zeros(0)) for _ in imgs]
+
+    # 640x480 and 600x450 share a letterbox at imgsz 640 but not an original size
+    imgs = [Image.new("RGB", size) for size in [(640, 480), (600, 450), (640, 480), (600, 450)]]
+    det = RecordingDetector()
+    out = list(detect.iter_detections(imgs, detector=det, batch=4))
+    assert sorted(d["index"] for d in out) == [0, 1, 2, 3]
+    assert sorted(det.batches) == [[(600, 450)] * 2, [(640, 480)] * 2]
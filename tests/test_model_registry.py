@@ -0,0 +1,56 @@
+from src.model_registry import ModelRegistry
+
+
+class FakeModel:
+    def __init__(self, path):
+        self.path = path
+        self.nbytes = 1
+
+
+def make_registry(closed, **kwargs):
+    specs = {"a": "a.pt", "b": "b.pt", "c": "c.pt"}
+    return ModelRegistry(FakeModel, specs, on_evict=lambda name, model: closed.append((name, model)), **kwargs)
+
+
+def test_evicted_model_closed_when_idle():
+    """Test that an evicted model with no users is handed to on_evict right away."""
+    closed = []
+    reg = make_registry(closed, max_models=1)
+    a = reg.get("a")
+    reg.get("b")
+    assert closed == [("a", a)]
+
+
+def test_evicted_model_closed_after_last_release():
+    """Test that an evicted model still in use is only handed to on_evict once every user has released it."""
+    closed = []
+    reg = make_registry(closed, max_models=1)
+    a = reg.acquire("a")
+    assert reg.acquire("a", load=False) is a
+    reg.get("b")
+    assert closed == [] and reg.stats()["retired"] == ["a"]
+    reg.release(a)
+    assert closed == []
+    reg.release(a)
+    assert closed == [("a", a)] and reg.stats()["retired"] == []
+
+
+def test_reload_closes_replaced_model():
+    """Test that reload swaps in a new model and closes the old one after its in-flight request releases it."""
+    closed = []
+    reg = make_registry(closed)
+    old = reg.acquire("a")
+    new = reg.reload("a")
+    assert new is not old and reg.get("a") is new
+    assert closed == []
+    reg.release(old)
+    assert closed == [("a", old)]
+
+
+def test_acquire_without_load():
+    """Test that acquire(load=False) returns None for a model that isn't resident and counts no user."""
+    reg = make_registry([])
+    assert reg.acquire("a", load=False) is None
+    a = reg.acquire("a")
+    reg.release(a)
+    assert reg.acquire("a", load=False) is a
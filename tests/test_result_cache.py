@@ -0,0 +1,53 @@
+import time
+
+from src.result_cache import ResultCache, make_key
+
+
+def test_key_covers_params():
+    """Test that the key changes with the bytes and with every inference parameter."""
+    base = make_key(b"img", 0.25, 640, "v1")
+    assert base == make_key(b"img", 0.25, 640, "v1")
+    assert len({base, make_key(b"img2", 0.25, 640, "v1"), make_key(b"img", 0.5, 640, "v1"),
+                make_key(b"img", 0.25, 320, "v1"), make_key(b"img", 0.25, 640, "v2")}) == 5
+
+
+def test_ttl():
+    """Test that entries expire after ttl_s."""
+    cache = ResultCache(ttl_s=0.05)
+    cache.put("a", 1, 10)
+    assert cache.get("a") == 1
+    time.sleep(0.06)
+    assert cache.get("a") is None
+    assert (cache.expirations, cache.bytes, cache.stats()["entries"]) == (1, 0, 0)
+
+
+def test_lru_order():
+    """Test that a get() refreshes an entry, so the least recently used one is evicted."""
+    cache = ResultCache(max_entries=2)
+    cache.put("a", 1, 1)
+    cache.put("b", 2, 1)
+    assert cache.get("a") == 1
+    cache.put("c", 3, 1)
+    assert cache.get("b") is None
+    assert (cache.get("a"), cache.get("c")) == (1, 3)
+    assert cache.evictions == 1
+
+
+def test_byte_budget():
+    """Test eviction by total bytes, replacement accounting, and that oversized values are not cached."""
+    cache = ResultCache(max_entries=100, max_bytes=100)
+    cache.put("a", 1, 40)
+    cache.put("b", 2, 40)
+    cache.put("a", 1, 50)  # replace: counted once
+    assert cache.bytes == 90
+    cache.put("c", 3, 30)  # over budget -> least recent ("b") goes
+    assert cache.get("b") is None and cache.bytes == 80
+    cache.put("huge", 4, 101)
+    assert cache.get("huge") is None and cache.bytes == 80
+
+
+def test_disabled():
+    """Test that max_entries=0 disables the cache."""
+    cache = ResultCache(max_entries=0)
+    cache.put("a", 1, 1)
+    assert cache.get("a") is None and not cache.enabled
@@ -0,0 +1,80 @@
+import os
+
+import detect
+from src.retention import prune
+
+NOW = 1_000_000.0
+
+
+def make(root, name, age, size=0, is_dir=True):
+    path = root / name
+    if is_dir:
+        path.mkdir()
+        (path / "x.bin").write_bytes(b"x" * size)
+    else:
+        path.write_bytes(b"x" * size)
+    os.utime(path, (NOW - age, NOW - age))
+    return path
+
+
+def names(root):
+    return sorted(p.name for p in root.iterdir())
+
+
+def test_prune_by_count(tmp_path):
+    """Test that the oldest entries go first once there are more than max_count."""
+    for i in range(5):
+        make(tmp_path, f"exp{i}", age=1000 - i)
+    result = prune(tmp_path, max_count=2, now=NOW)
+    assert names(tmp_path) == ["exp3", "exp4"]
+    assert (result["removed"], result["kept"]) == (3, 2)
+
+
+def test_prune_by_bytes(tmp_path):
+    """Test that the oldest entries go until the total size fits max_bytes."""
+    for i in range(4):
+        make(tmp_path, f"exp{i}", age=1000 - i, size=100)
+    make(tmp_path, "upload.jpg", age=2000, size=100, is_dir=False)
+    result = prune(tmp_path, max_bytes=250, now=NOW)
+    assert names(tmp_path) == ["exp2", "exp3"]
+    assert (result["freed_bytes"], result["kept_bytes"]) == (300, 200)
+
+
+def test_prune_by_age(tmp_path):
+    """Test that entries older than max_age_s are removed regardless of count."""
+    make(tmp_path, "old", age=7200)
+    make(tmp_path, "new", age=600)
+    prune(tmp_path, max_age_s=3600, now=NOW)
+    assert names(tmp_path) == ["new"]
+
+
+def test_grace_period_and_dotfiles(tmp_path):
+    """Test that recent entries (min_age_s) and dotfiles such as .exp_counter are never removed."""
+    make(tmp_path, "exp1", age=10, size=1000)
+    make(tmp_path, "exp2", age=5, size=1000)
+    make(tmp_path, ".exp_counter", age=10 ** 6, size=1, is_dir=False)
+    result = prune(tmp_path, max_count=0, max_bytes=0, max_age_s=0, min_age_s=60, now=NOW)
+    assert names(tmp_path) == [".exp_counter", "exp1", "exp2"]
+    assert result["removed"] == 0
+
+
+def test_prune_missing_root(tmp_path):
+    """Test that a directory that doesn't exist yet is a no-op."""
+    assert prune(tmp_path / "nope", max_count=1)["removed"] == 0
+
+
+def test_next_exp_dir_seeds_counter(tmp_path):
+    """Test that the counter is seeded from existing runs (numerically, so exp10 follows exp9) and then bumped."""
+    for n in (1, 2, 9):
+        (tmp_path / f"exp{n}").mkdir()
+    (tmp_path / "expfoo").mkdir()
+    assert os.path.basename(detect.next_exp_dir(str(tmp_path))) == "exp10"
+    assert (tmp_path / ".exp_counter").read_text() == "11"
+    assert os.path.basename(detect.next_exp_dir(str(tmp_path))) == "exp11"
+
+
+def test_next_exp_dir_skips_taken(tmp_path):
+    """Test that a stale counter never reuses an existing folder, and an empty base starts at exp1."""
+    assert os.path.basename(detect.next_exp_dir(str(tmp_path / "runs"))) == "exp1"
+    (tmp_path / "runs" / "exp2").mkdir()
+    assert os.path.basename(detect.next_exp_dir(str(tmp_path / "runs"))) == "exp3"
@@ -0,0 +1,84 @@
+import asyncio
+import time
+
+import pytest
+
+from src.admission import DeadlineExceeded, Rejected
+from src.single_flight import SingleFlight
+
+
+def run_pair(leader_exc):
+    """Leader fails with a request-specific error while a follower without a deadline waits on the same key."""
+    sf = SingleFlight()
+    calls = []
+
+    async def leader_fn():
+        calls.append("leader")
+        await asyncio.sleep(0.05)
+        raise leader_exc
+
+    async def follower_fn():
+        calls.append("follower")
+        return "result"
+
+    async def main():
+        leader = asyncio.create_task(sf.do("k", leader_fn, deadline=time.monotonic() + 0.05))
+        await asyncio.sleep(0)
+        follower = asyncio.create_task(sf.do("k", follower_fn))
+        return await asyncio.gather(leader, follower, return_exceptions=True)
+
+    return sf, calls, asyncio.run(main())
+
+
+@pytest.mark.parametrize("exc", [DeadlineExceeded(), Rejected(503, "overloaded", 1)])
+def test_follower_not_failed_by_leader_deadline(exc):
+    """Test that a follower retries as leader instead of inheriting the leader's deadline or rejection."""
+    sf, calls, (leader, follower) = run_pair(exc)
+    assert isinstance(leader, type(exc))
+    assert follower == ("result", False)
+    assert calls == ["leader", "follower"]
+    assert sf.retried == 1 and sf.inflight == 0
+
+
+def test_shared_result_and_errors():
+    """Test that concurrent callers share one execution, including ordinary exceptions."""
+    sf = SingleFlight()
+    calls = []
+
+    async def fn():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return 42
+
+    async def boom():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        raise ValueError("bad image")
+
+    async def main():
+        ok = await asyncio.gather(*[sf.do("a", fn) for _ in range(5)])
+        bad = await asyncio.gather(*[sf.do("b", boom) for _ in range(3)], return_exceptions=True)
+        return ok, bad
+
+    ok, bad = asyncio.run(main())
+    assert ok == [(42, False)] + [(42, True)] * 4
+    assert all(isinstance(e, ValueError) for e in bad)
+    assert len(calls) == 2
+
+
+def test_follower_deadline_passed():
+    """Test that a follower whose own deadline has passed gets DeadlineExceeded."""
+    sf = SingleFlight()
+
+    async def slow():
+        await asyncio.sleep(0.2)
+        return 1
+
+    async def main():
+        leader = asyncio.create_task(sf.do("k", slow))
+        await asyncio.sleep(0)
+        with pytest.raises(DeadlineExceeded):
+            await sf.do("k", slow, deadline=time.monotonic() + 0.02)
+        assert await leader == (1, False)
+
+    asyncio.run(main())
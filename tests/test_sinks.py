@@ -0,0 +1,71 @@
+import json
+
+import numpy as np
+import pytest
+
+import detect
+
+BOXES = np.array([[0, 0, 50, 50], [10, 10, 20, 20], [0, 0, 100, 50]], dtype=np.float32)
+SCORES = np.array([0.9, 0.1, 0.5], dtype=np.float32)
+CLASSES = np.array([3, 4, 7], dtype=np.float32)
+EMPTY = (np.zeros((0, 4), np.float32), np.zeros((0,), np.float32), np.zeros((0,), np.float32))
+
+
+def write(sink_cls, path, images, chunk_images):
+    with sink_cls(path, chunk_images=chunk_images) as sink:
+        for name, size, preds in images:
+            sink.add(name, size, *preds, conf=0.25)
+    return sink
+
+
+@pytest.mark.parametrize("chunk_images", [1, 2, 1024])
+def test_npz_round_trip(tmp_path, chunk_images):
+    """Test that the .npz reads back with np.load, including empty images and chunk boundaries."""
+    images = [("a.jpg", (100, 50), (BOXES, SCORES, CLASSES)), ("b.jpg", (64, 32), EMPTY),
+              ("c.jpg", (200, 100), (BOXES[:1], SCORES[:1], CLASSES[:1]))]
+    sink = write(detect.NpzSink, tmp_path / "d.npz", images, chunk_images)
+    assert (sink.images, sink.detections) == (3, 3)
+
+    with np.load(tmp_path / "d.npz") as z:
+        assert sorted(z.files) == ["box", "cls", "conf", "offset", "path", "size"]
+        assert z["path"].tolist() == ["a.jpg", "b.jpg", "c.jpg"]
+        assert z["offset"].tolist() == [0, 2, 2, 3]
+        assert z["size"].tolist() == [[100, 50], [64, 32], [200, 100]]
+        assert z["cls"].tolist() == [3, 7, 3]
+        assert z["conf"].tolist() == pytest.approx([0.9, 0.5, 0.9])
+        assert z["box"].shape == (3, 4) and z["box"].dtype == np.float32
+        assert z["box"][1].tolist() == pytest.approx([0.5, 0.5, 1.0, 1.0])
+        assert z["box"][2].tolist() == pytest.approx([0.125, 0.25, 0.25, 0.5])
+    assert not [p for p in tmp_path.iterdir() if p.name != "d.npz"]  # temporary column files are gone
+
+
+def test_npz_no_detections(tmp_path):
+    """Test an .npz for images without any detection, and for no images at all."""
+    write(detect.NpzSink, tmp_path / "empty.npz", [("a.jpg", (10, 10), EMPTY), ("b.jpg", (10, 10), EMPTY)], 1)
+    with np.load(tmp_path / "empty.npz") as z:
+        assert z["offset"].tolist() == [0, 0, 0]
+        assert z["box"].shape == (0, 4) and z["cls"].shape == (0,) and z["conf"].shape == (0,)
+        assert z["path"].tolist() == ["a.jpg", "b.jpg"]
+
+    write(detect.NpzSink, tmp_path / "none.npz", [], 1)
+    with np.load(tmp_path / "none.npz") as z:
+        assert z["offset"].tolist() == [0]
+        assert z["path"].shape == (0,) and z["size"].shape == (0, 2) and z["box"].shape == (0, 4)
+
+
+@pytest.mark.parametrize("chunk_images", [1, 1024])
+def test_jsonl_round_trip(tmp_path, chunk_images):
+    """Test that every image is one JSON line, with empty images and chunk boundaries."""
+    images = [("a.jpg", (100, 50), (BOXES, SCORES, CLASSES)), ("b.jpg", (64, 32), EMPTY)]
+    write(detect.JsonlSink, tmp_path / "d.jsonl", images, chunk_images)
+    rows = [json.loads(line) for line in (tmp_path / "d.jsonl").read_text().splitlines()]
+    assert [r["path"] for r in rows] == ["a.jpg", "b.jpg"]
+    assert rows[0]["cls"] == [3, 7] and rows[0]["conf"] == [0.9, 0.5]
+    assert rows[0]["box"] == [[0.25, 0.5, 0.5, 1.0], [0.5, 0.5, 1.0, 1.0]]
+    assert rows[1] == {"path": "b.jpg", "width": 64, "height": 32, "cls": [], "box": [], "conf": []}
+
+
+def test_jsonl_no_images(tmp_path):
+    """Test that a run without images leaves an empty JSONL file."""
+    write(detect.JsonlSink, tmp_path / "d.jsonl", [], 1)
+    assert (tmp_path / "d.jsonl").read_text() == ""
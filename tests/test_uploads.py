@@ -0,0 +1,66 @@
+import asyncio
+
+import pytest
+
+from src.uploads import BadUpload, UploadTooLarge, read_form
+
+BOUNDARY = "testboundary"
+
+
+class FakeRequest:
+    """Just enough of a Starlette request for read_form: headers and an async body stream."""
+
+    def __init__(self, body, chunk=1024, headers=None):
+        self.body = body
+        self.chunk = chunk
+        self.sent = 0
+        self.headers = {"content-type": f"multipart/form-data; boundary={BOUNDARY}", **(headers or {})}
+
+    async def stream(self):
+        for i in range(0, len(self.body), self.chunk):
+            self.sent += 1
+            yield self.body[i:i + self.chunk]
+
+
+def form(fields=(), files=()):
+    parts = [f'--{BOUNDARY}\r\nContent-Disposition: form-data; name="{k}"\r\n\r\n{v}\r\n'.encode() for k, v in fields]
+    for name, filename, data in files:
+        parts.append(f'--{BOUNDARY}\r\nContent-Disposition: form-data; name="{name}"; filename="{filename}"\r\n'
+                     f'Content-Type: image/jpeg\r\n\r\n'.encode() + data + b"\r\n")
+    return b"".join(parts) + f"--{BOUNDARY}--\r\n".encode()
+
+
+def test_read_form():
+    """Test that fields and files are parsed into memory."""
+    req = FakeRequest(form([("conf", "0.5")], [("file", "a.jpg", b"\xff\xd8" + b"x" * 5000)]), chunk=700)
+    fields, files = asyncio.run(read_form(req, max_bytes=1 << 20))
+    assert fields == {"conf": "0.5"}
+    assert [(f.name, f.filename, f.content_type) for f in files] == [("file", "a.jpg", "image/jpeg")]
+    assert bytes(files[0].data) == b"\xff\xd8" + b"x" * 5000
+
+
+def test_too_large_while_streaming():
+    """Test that 413 is raised as soon as the streamed body passes the limit, without reading the rest."""
+    req = FakeRequest(form(files=[("file", "a.jpg", b"x" * 100_000)]), chunk=1024)
+    with pytest.raises(UploadTooLarge) as e:
+        asyncio.run(read_form(req, max_bytes=10_000))
+    assert e.value.limit == 10_000
+    assert req.sent == 10  # stopped at the first chunk over the limit, of ~98
+
+
+def test_too_large_by_content_length():
+    """Test that a declared Content-Length over the limit is rejected before streaming."""
+    req = FakeRequest(form(files=[("file", "a.jpg", b"x" * 100)]), headers={"content-length": "20000"})
+    with pytest.raises(UploadTooLarge):
+        asyncio.run(read_form(req, max_bytes=10_000))
+    assert req.sent == 0
+
+
+def test_bad_upload():
+    """Test non-multipart bodies and too many parts."""
+    req = FakeRequest(b"{}", headers={"content-type": "application/json"})
+    with pytest.raises(BadUpload):
+        asyncio.run(read_form(req, max_bytes=1000))
+    req = FakeRequest(form([(f"f{i}", "v") for i in range(5)]))
+    with pytest.raises(BadUpload):
+        asyncio.run(read_form(req, max_bytes=1 << 20, max_parts=3))
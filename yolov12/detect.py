@@ -1,31 +1,140 @@
 #!/usr/bin/env python3
 import argparse
+import ast
 import os
 import glob
+import hashlib
+import io
+import json
+import shutil
+import tempfile
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from PIL import Image, ImageDraw, ImageFont
-import torch
 import numpy as np
+try:
+    import fcntl
+except ImportError:  # Windows: no lock, the atomic mkdir still keeps runs apart
+    fcntl = None
+# torch is imported lazily by the torch backend, so ONNX-only inference never pays for it
+
+# torch.hub fallback (when ultralytics is not installed): the hub repo is fetched once at a pinned ref into a local,
+# versioned cache and loaded from there, so later runs work offline. YOLO_HUB_SHA256 pins the archive checksum.
+HUB_REPO = os.environ.get('YOLO_HUB_REPO', 'ultralytics/yolov5')
+HUB_REF = os.environ.get('YOLO_HUB_REF', 'v7.0')
+HUB_SHA256 = os.environ.get('YOLO_HUB_SHA256', '')
+HUB_CACHE_DIR = os.environ.get('YOLO_HUB_CACHE_DIR', os.path.join(Path.home(), '.cache', 'foodcal', 'hub'))
 
 def next_exp_dir(base='runs/detect'):
+    # expN comes from a counter file (base/.exp_counter) read and bumped under a file lock, so picking the next
+    # run is O(1) however many runs exist; the counter is seeded from one scan of base if it is missing.
+    # The folder itself is claimed with an atomic mkdir, so concurrent runs never share an output folder.
     Path(base).mkdir(parents=True, exist_ok=True)
-    exps = sorted(glob.glob(os.path.join(base, 'exp*')))
-    if not exps:
-        return os.path.join(base, 'exp1')
-    last = exps[-1]
+    fd = os.open(os.path.join(base, '.exp_counter'), os.O_RDWR | os.O_CREAT, 0o644)
     try:
-        n = int(Path(last).name.replace('exp', '')) + 1
-    except Exception:
-        n = len(exps) + 1
-    return os.path.join(base, f'exp{n}')
+        if fcntl is not None:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+        text = os.read(fd, 32).decode('ascii', 'ignore').strip()
+        if text.isdigit():
+            n = int(text)
+        else:
+            nums = [int(m.name[3:]) for m in Path(base).glob('exp*') if m.name[3:].isdigit()]
+            n = max(nums, default=0) + 1
+        while True:
+            out_dir = os.path.join(base, f'exp{n}')
+            try:
+                os.mkdir(out_dir)
+                break
+            except FileExistsError:
+                n += 1
+        os.lseek(fd, 0, os.SEEK_SET)
+        os.ftruncate(fd, 0)
+        os.write(fd, str(n + 1).encode('ascii'))
+        return out_dir
+    finally:
+        os.close(fd)  # also releases the lock
+
+def file_sha256(path, chunk_size=1 << 20):
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+def _download(url, dest):
+    # to dest.part, then renamed, so an interrupted download never looks complete
+    import urllib.request
+    tmp = f'{dest}.{os.getpid()}.part'
+    try:
+        with urllib.request.urlopen(url, timeout=60) as resp, open(tmp, 'wb') as f:
+            shutil.copyfileobj(resp, f, 1 << 20)
+        os.replace(tmp, dest)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+
+def resolve_hub_repo(repo=HUB_REPO, ref=HUB_REF, cache_dir=HUB_CACHE_DIR, sha256=HUB_SHA256):
+    # -> local directory of `repo` at `ref` for torch.hub.load(..., source='local').
+    # <cache_dir>/<owner>_<name>-<ref>.zip is downloaded once and extracted next to it; a manifest records the
+    # archive's sha256, and the cache is only used while the archive still matches it (and the pin, if set).
+    # Anything else (missing, corrupt, different pin) is fetched again; without network that is an error.
+    cache = Path(cache_dir)
+    cache.mkdir(parents=True, exist_ok=True)
+    stem = f"{repo.replace('/', '_')}-{ref}"
+    root, archive = cache / stem, cache / f'{stem}.zip'
+    manifest = root / '.manifest.json'
+    fd = os.open(cache / '.lock', os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        if fcntl is not None:
+            fcntl.flock(fd, fcntl.LOCK_EX)  # one process downloads, the others then find it cached
+        try:
+            recorded = json.loads(manifest.read_text())['sha256']
+        except (OSError, ValueError, KeyError):
+            recorded = None
+        expected = sha256 or recorded
+        digest = file_sha256(archive) if archive.is_file() else None
+        if recorded and digest == recorded == expected:
+            return str(root)
+
+        if digest is None or (expected and digest != expected):
+            url = f'https://github.com/{repo}/archive/{ref}.zip'
+            t0 = time.perf_counter()
+            try:
+                _download(url, archive)
+            except OSError as e:
+                raise RuntimeError(f"{repo}@{ref} is not in the hub cache ({cache}) and could not be downloaded: {e}") from e
+            print(f"Cached {url} in {time.perf_counter() - t0:.1f}s")
+            digest = file_sha256(archive)
+        if sha256 and digest != sha256:
+            archive.unlink()
+            raise RuntimeError(f"checksum mismatch for {repo}@{ref}: expected {sha256}, got {digest}")
+
+        import zipfile
+        tmp = Path(tempfile.mkdtemp(prefix=f'.{stem}.', dir=cache))
+        try:
+            with zipfile.ZipFile(archive) as zf:
+                zf.extractall(tmp)
+            top = [p for p in tmp.iterdir() if p.is_dir()]
+            src = top[0] if len(top) == 1 else tmp  # github archives hold a single <name>-<ref>/ folder
+            (src / '.manifest.json').write_text(json.dumps({'repo': repo, 'ref': ref, 'sha256': digest}))
+            shutil.rmtree(root, ignore_errors=True)
+            os.replace(src, root)
+        finally:
+            shutil.rmtree(tmp, ignore_errors=True)
+        return str(root)
+    finally:
+        os.close(fd)
 
 def xyxy_to_yolo(xyxy, img_w, img_h):
-    x1, y1, x2, y2 = xyxy
-    cx = ((x1 + x2) / 2.0) / img_w
-    cy = ((y1 + y2) / 2.0) / img_h
-    w = (x2 - x1) / img_w
-    h = (y2 - y1) / img_h
-    return cx, cy, w, h
+    # (..., 4) pixel x1, y1, x2, y2 -> (..., 4) normalized cx, cy, w, h, for one box or a whole array at once
+    xyxy = np.asarray(xyxy, dtype=np.float64)
+    out = np.empty(xyxy.shape, dtype=np.float64)
+    out[..., :2] = (xyxy[..., :2] + xyxy[..., 2:]) / 2.0
+    out[..., 2:] = xyxy[..., 2:] - xyxy[..., :2]
+    out /= (img_w, img_h, img_w, img_h)
+    return out
 
 def draw_boxes_pil(img, boxes, scores, classes, names, conf_thres):
     draw = ImageDraw.Draw(img)
@@ -42,92 +151,647 @@ def draw_boxes_pil(img, boxes, scores, classes, names, conf_thres):
             draw.text((x1 + 3, y1 + 3), label, fill='red', font=font)
     return img
 
-def run(weights, source, conf, save_txt, save_img):
-    # Prefer ultralytics YOLO API if available (avoids torch.hub cache issues)
-    try:
-        from ultralytics import YOLO
-        model = YOLO(weights)
-        use_ultralytics = True
-    except Exception:
-        # fallback to torch.hub (yolov5 repo)
-        model = torch.hub.load('ultralytics/yolov5', 'custom', path=weights, force_reload=True, trust_repo=True)
-        model.conf = conf
-        use_ultralytics = False
+class Detector:
+    # Resident model wrapper: load weights once, then call predict() per image batch
+    def __init__(self, weights, conf=0.25):
+        self.weights = str(weights)
+        self.version = file_sha256(self.weights)[:12] if os.path.isfile(self.weights) else self.weights
+        # Prefer ultralytics YOLO API if available (avoids torch.hub cache issues)
+        try:
+            from ultralytics import YOLO
+            self.model = YOLO(self.weights)
+            self.use_ultralytics = True
+        except Exception:
+            # fallback to torch.hub (yolov5 repo), loaded from the local versioned cache rather than re-fetched
+            import torch
+            self.model = torch.hub.load(resolve_hub_repo(), 'custom', path=self.weights, source='local')
+            self.model.conf = conf
+            self.use_ultralytics = False
+        self.names = self.model.names
+        self.last_timings = {}  # seconds spent per stage in the latest predict() call (whole batch)
 
-    # prepare output folder
-    base_runs = os.path.join(Path(__file__).parent, 'runs', 'detect')
-    out_dir = next_exp_dir(base=base_runs)
-    Path(out_dir).mkdir(parents=True, exist_ok=True)
-    labels_dir = os.path.join(out_dir, 'labels')
-    if save_txt:
-        Path(labels_dir).mkdir(parents=True, exist_ok=True)
+    @property
+    def nbytes(self):
+        # approximate resident size of the weights (parameters + buffers), falling back to the file size
+        try:
+            net = getattr(self.model, 'model', self.model)
+            return int(sum(t.numel() * t.element_size() for t in list(net.parameters()) + list(net.buffers())))
+        except Exception:
+            return os.path.getsize(self.weights) if os.path.isfile(self.weights) else 0
 
-    # collect sources
-    srcs = []
-    p = Path(source)
-    if p.is_dir():
-        srcs = sorted([str(x) for x in p.glob('*') if x.suffix.lower() in ('.jpg', '.jpeg', '.png')])
-    elif p.is_file():
-        srcs = [str(p)]
-    else:
-        srcs = sorted(glob.glob(source))
-        if not srcs:
-            raise FileNotFoundError(f"No source files found for: {source}")
-
-    print(f"Found {len(srcs)} images. Saving results to: {out_dir}")
-
-    for img_path in srcs:
-        img = Image.open(img_path).convert('RGB')
-        img_w, img_h = img.size
-
-        # inference (handle ultralytics YOLO vs torch.hub result formats)
-        results = model(img)
-        if use_ultralytics:
-            r = results[0]
-            if hasattr(r, 'boxes') and len(r.boxes):
-                boxes = r.boxes.xyxy.cpu().numpy()
-                scores = r.boxes.conf.cpu().numpy()
-                classes = r.boxes.cls.cpu().numpy()
-            else:
-                boxes = np.zeros((0,4)); scores = np.zeros((0,)); classes = np.zeros((0,))
-        else:
-            preds = results.pred[0]  # tensor Nx6 (x1,y1,x2,y2,conf,cls)
-            preds = preds.cpu().numpy() if isinstance(preds, torch.Tensor) else np.array(preds)
+    def predict(self, imgs, conf=0.25, imgsz=None):
+        # imgs: list of PIL images -> list of (boxes xyxy, scores, classes) numpy arrays
+        if self.use_ultralytics:
+            kwargs = {'conf': conf, 'verbose': False}
+            if imgsz:
+                kwargs['imgsz'] = imgsz
+            results = self.model(imgs, **kwargs)
+            # ultralytics reports per-image ms for each stage
+            speed = [getattr(r, 'speed', None) or {} for r in results]
+            self.last_timings = {stage: sum(sp.get(key) or 0.0 for sp in speed) / 1000.0
+                                 for stage, key in (('preprocess', 'preprocess'), ('forward', 'inference'), ('nms', 'postprocess'))}
+            out = []
+            for r in results:
+                if hasattr(r, 'boxes') and len(r.boxes):
+                    out.append((r.boxes.xyxy.cpu().numpy(), r.boxes.conf.cpu().numpy(), r.boxes.cls.cpu().numpy()))
+                else:
+                    out.append((np.zeros((0, 4)), np.zeros((0,)), np.zeros((0,))))
+            return out
+
+        self.model.conf = conf
+        results = self.model(imgs, size=imgsz) if imgsz else self.model(imgs)
+        t = getattr(results, 't', None)  # per-image ms for (preprocess, inference, nms)
+        if t:
+            self.last_timings = {stage: ms * len(imgs) / 1000.0 for stage, ms in zip(('preprocess', 'forward', 'nms'), t)}
+        out = []
+        for preds in results.pred:  # tensor Nx6 (x1,y1,x2,y2,conf,cls)
+            preds = preds.cpu().numpy() if hasattr(preds, 'cpu') else np.array(preds)
             boxes = preds[:, :4] if preds.size else np.zeros((0, 4))
             scores = preds[:, 4] if preds.size else np.zeros((0,))
             classes = preds[:, 5] if preds.size else np.zeros((0,))
+            out.append((boxes, scores, classes))
+        return out
+
+    def warmup(self, imgsz=640, conf=0.25):
+        # one dummy forward pass so the first real request doesn't pay for lazy init
+        self.predict([Image.new('RGB', (imgsz, imgsz))], conf=conf, imgsz=imgsz)
+
+def check_imgsz(imgsz, stride=32):
+    # round imgsz (default 640) up to a multiple of the model stride, as ultralytics does; exported YOLO graphs
+    # only line up their upsample/concat layers at multiples of it
+    return max(stride, -(-int(imgsz or 640) // stride) * stride)
+
+def letterbox(img, new_shape=(640, 640), color=114, out=None):
+    # PIL image -> (HxWx3 uint8 canvas of new_shape (h, w), scale ratio, (pad_left, pad_top));
+    # pass `out` to reuse a preallocated canvas
+    h, w = new_shape
+    w0, h0 = img.size
+    r = min(h / h0, w / w0)
+    nw, nh = int(round(w0 * r)), int(round(h0 * r))
+    canvas = out if out is not None else np.empty((h, w, 3), dtype=np.uint8)
+    canvas.fill(color)
+    left, top = (w - nw) // 2, (h - nh) // 2
+    resized = img.resize((nw, nh), Image.BILINEAR) if (nw, nh) != (w0, h0) else img
+    canvas[top:top + nh, left:left + nw] = np.asarray(resized)
+    return canvas, r, (left, top)
+
+def letterbox_batch(imgs, shape, out=None):
+    # list of PIL images -> (float32 NCHW batch in [0, 1], [(ratio, pad)] per image); `out` is a reusable uint8 NHWC buffer
+    batch = np.empty((len(imgs), shape[0], shape[1], 3), dtype=np.uint8) if out is None else out[:len(imgs)]
+    metas = []
+    for i, img in enumerate(imgs):
+        _, r, pad = letterbox(img, shape, out=batch[i])
+        metas.append((r, pad))
+    x = batch.transpose(0, 3, 1, 2).astype(np.float32)
+    x *= 1.0 / 255.0
+    return x, metas
+
+def nms(boxes, scores, iou_thres=0.7, max_det=None):
+    # greedy NMS, vectorized IoU per step; returns kept indices in descending score order, stopping at max_det
+    x1, y1, x2, y2 = boxes.T
+    areas = (x2 - x1).clip(0) * (y2 - y1).clip(0)
+    order = scores.argsort()[::-1]
+    keep = []
+    while order.size:
+        i = order[0]
+        keep.append(i)
+        if max_det is not None and len(keep) >= max_det:
+            break
+        rest = order[1:]
+        iw = (np.minimum(x2[i], x2[rest]) - np.maximum(x1[i], x1[rest])).clip(0)
+        ih = (np.minimum(y2[i], y2[rest]) - np.maximum(y1[i], y1[rest])).clip(0)
+        inter = iw * ih
+        iou = inter / (areas[i] + areas[rest] - inter + 1e-9)
+        order = rest[iou <= iou_thres]
+    return np.asarray(keep, dtype=np.int64)
+
+def postprocess_raw(pred, conf, ratio, pad, img_size, iou_thres=0.7, max_det=300):
+    # pred: raw YOLO head output for one image, shape (4 + nc, N) with cx, cy, w, h in letterbox pixels.
+    # Returns (boxes xyxy in original image pixels, scores, classes) like Detector.predict.
+    p = pred.T
+    cls_scores = p[:, 4:]
+    classes = cls_scores.argmax(1)
+    scores = cls_scores[np.arange(len(p)), classes]
+    m = scores >= conf
+    p, scores, classes = p[m], scores[m], classes[m]
+    if not len(p):
+        return np.zeros((0, 4), dtype=np.float32), np.zeros((0,), dtype=np.float32), np.zeros((0,), dtype=np.float32)
+
+    half_wh = p[:, 2:4] / 2
+    boxes = np.concatenate([p[:, :2] - half_wh, p[:, :2] + half_wh], axis=1)
+    # class-aware NMS in one pass: shift each class into its own coordinate range
+    keep = nms(boxes + classes[:, None] * 7680.0, scores, iou_thres, max_det)
+    boxes, scores, classes = boxes[keep], scores[keep], classes[keep]
+
+    boxes = (boxes - np.array([pad[0], pad[1], pad[0], pad[1]], dtype=boxes.dtype)) / ratio
+    img_w, img_h = img_size
+    boxes[:, [0, 2]] = boxes[:, [0, 2]].clip(0, img_w)
+    boxes[:, [1, 3]] = boxes[:, [1, 3]].clip(0, img_h)
+    return boxes.astype(np.float32), scores.astype(np.float32), classes.astype(np.float32)
+
+class OnnxDetector:
+    # ONNX Runtime CPU backend with the same predict() contract as Detector.
+    # The session is created once and reused; pre/postprocessing is plain NumPy.
+    def __init__(self, weights, conf=0.25, intra_op_threads=0, inter_op_threads=0, iou=0.7, max_det=300):
+        import onnxruntime as ort
+        self.weights = str(weights)
+        self.version = file_sha256(self.weights)[:12]
+        self.iou = iou
+        self.max_det = max_det
+
+        so = ort.SessionOptions()
+        so.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        so.execution_mode = ort.ExecutionMode.ORT_SEQUENTIAL
+        if intra_op_threads:
+            so.intra_op_num_threads = int(intra_op_threads)
+        if inter_op_threads:
+            so.inter_op_num_threads = int(inter_op_threads)
+        self.session = ort.InferenceSession(self.weights, sess_options=so, providers=['CPUExecutionProvider'])
+
+        inp = self.session.get_inputs()[0]
+        self.input_name = inp.name
+        self.dynamic_batch = not isinstance(inp.shape[0], int)
+        self.static_shape = tuple(inp.shape[2:]) if all(isinstance(d, int) for d in inp.shape[2:]) else None
+        meta = self.session.get_modelmeta().custom_metadata_map
+        if 'names' in meta:
+            self.names = ast.literal_eval(meta['names'])
+        else:
+            nc = self.session.get_outputs()[0].shape[1] - 4
+            self.names = {i: str(i) for i in range(nc)}
+        self.last_timings = {}
+
+    @property
+    def nbytes(self):
+        return os.path.getsize(self.weights)
+
+    def input_shape(self, imgsz=None):
+        if self.static_shape:
+            return self.static_shape
+        imgsz = check_imgsz(imgsz)
+        return (imgsz, imgsz)
+
+    def preprocess(self, imgs, imgsz=None, out=None):
+        return letterbox_batch(imgs, self.input_shape(imgsz), out=out)
+
+    def predict(self, imgs, conf=0.25, imgsz=None, out=None):
+        t0 = time.perf_counter()
+        x, metas = self.preprocess(imgs, imgsz, out=out)
+        t1 = time.perf_counter()
+        if self.dynamic_batch:
+            preds = self.session.run(None, {self.input_name: x})[0]
+        else:
+            preds = np.concatenate([self.session.run(None, {self.input_name: x[i:i + 1]})[0] for i in range(len(x))])
+        t2 = time.perf_counter()
+        results = [postprocess_raw(preds[i], conf, r, pad, img.size, self.iou, self.max_det)
+                   for i, (img, (r, pad)) in enumerate(zip(imgs, metas))]
+        self.last_timings = {'preprocess': t1 - t0, 'forward': t2 - t1, 'nms': time.perf_counter() - t2}
+        return results
+
+    def warmup(self, imgsz=640, conf=0.25):
+        self.predict([Image.new('RGB', (imgsz, imgsz))], conf=conf, imgsz=imgsz)
+
+class MappedDetector:
+    # Torch backend for inference worker processes. The fused module written by export_mapped() is loaded with
+    # torch.load(mmap=True): its weights stay file-backed, so every process maps the same read-only pages
+    # instead of holding a private copy. Pre/postprocessing is the same NumPy path as OnnxDetector.
+    def __init__(self, path, conf=0.25, threads=0, iou=0.7, max_det=300):
+        import torch
+        if threads:
+            torch.set_num_threads(int(threads))
+        self.path = str(path)
+        ckpt = torch.load(self.path, map_location='cpu', mmap=True, weights_only=False)
+        self.model = ckpt['model']
+        self.names = ckpt['names']
+        self.version = ckpt['version']
+        self.iou = iou
+        self.max_det = max_det
+        self.last_timings = {}
+
+    @property
+    def nbytes(self):
+        return os.path.getsize(self.path)
+
+    def input_shape(self, imgsz=None):
+        imgsz = check_imgsz(imgsz)
+        return (imgsz, imgsz)
+
+    def preprocess(self, imgs, imgsz=None, out=None):
+        return letterbox_batch(imgs, self.input_shape(imgsz), out=out)
+
+    def predict(self, imgs, conf=0.25, imgsz=None, out=None):
+        import torch
+        t0 = time.perf_counter()
+        x, metas = self.preprocess(imgs, imgsz, out=out)
+        t1 = time.perf_counter()
+        with torch.inference_mode():
+            preds = self.model(torch.from_numpy(x))
+        preds = (preds[0] if isinstance(preds, (list, tuple)) else preds).numpy()
+        t2 = time.perf_counter()
+        results = [postprocess_raw(preds[i], conf, r, pad, img.size, self.iou, self.max_det)
+                   for i, (img, (r, pad)) in enumerate(zip(imgs, metas))]
+        self.last_timings = {'preprocess': t1 - t0, 'forward': t2 - t1, 'nms': time.perf_counter() - t2}
+        return results
+
+    def warmup(self, imgsz=640, conf=0.25):
+        self.predict([Image.new('RGB', (imgsz, imgsz))], conf=conf, imgsz=imgsz)
+
+def export_mapped(weights, out_path):
+    # fuse conv+bn once and save the fp32 eval-mode module as a plain torch checkpoint for MappedDetector;
+    # written to a temp file and renamed, so processes still mapping an older export keep a valid file
+    import torch
+    from ultralytics import YOLO
+    model = YOLO(weights).model.float().fuse(verbose=False).eval()
+    for p in model.parameters():
+        p.requires_grad_(False)
+    tmp = f'{out_path}.{os.getpid()}.tmp'
+    torch.save({'model': model, 'names': model.names, 'version': file_sha256(weights)[:12]}, tmp)
+    os.replace(tmp, out_path)
+    return str(out_path)
 
-        stem = Path(img_path).stem
-        out_img_path = os.path.join(out_dir, Path(img_path).name)
-        label_txt_path = os.path.join(labels_dir, stem + '.txt')
+def resolve_mapped(weights):
+    # <weights>.fused.pt next to the checkpoint; re-exported whenever the checkpoint is newer
+    weights = Path(weights)
+    mapped = weights.with_suffix('.fused.pt')
+    if not mapped.exists() or mapped.stat().st_mtime < weights.stat().st_mtime:
+        export_mapped(str(weights), mapped)
+    return str(mapped)
 
-        # save txt in YOLO format
-        if save_txt:
-            with open(label_txt_path, 'w') as f:
-                for (x1, y1, x2, y2), s, c in zip(boxes, scores, classes):
-                    if s < conf:
+def export_onnx(weights, imgsz=640, dynamic=True, simplify=True):
+    # export a .pt checkpoint next to itself as .onnx (raw head output, NMS done in postprocess_raw)
+    from ultralytics import YOLO
+    return YOLO(weights).export(format='onnx', imgsz=imgsz, dynamic=dynamic, simplify=simplify)
+
+def resolve_onnx(weights, imgsz=640):
+    # .onnx path for weights; a .pt is exported on first use and re-exported whenever it is newer than its .onnx
+    weights = Path(weights)
+    if weights.suffix == '.onnx':
+        return str(weights)
+    onnx_path = weights.with_suffix('.onnx')
+    if not onnx_path.exists() or onnx_path.stat().st_mtime < weights.stat().st_mtime:
+        exported = export_onnx(str(weights), imgsz=imgsz)
+        if Path(exported) != onnx_path:
+            os.replace(exported, onnx_path)
+    return str(onnx_path)
+
+def load_detector(weights, backend='auto', conf=0.25, imgsz=640, intra_op_threads=0, inter_op_threads=0):
+    # backend: 'torch' (ultralytics / torch.hub), 'onnx' (onnxruntime), or 'auto' (onnx for .onnx files)
+    if backend == 'onnx' or (backend == 'auto' and str(weights).endswith('.onnx')):
+        return OnnxDetector(resolve_onnx(weights, imgsz=imgsz), conf=conf,
+                            intra_op_threads=intra_op_threads, inter_op_threads=inter_op_threads)
+    return Detector(weights, conf=conf)
+
+def save_result(out_dir, name, img, boxes, scores, classes, names, conf, save_txt=True, save_img=True):
+    # write YOLO-format labels to out_dir/labels/<stem>.txt and the annotated image to out_dir/<name>
+    img_w, img_h = img.size
+    if save_txt:
+        labels_dir = os.path.join(out_dir, 'labels')
+        Path(labels_dir).mkdir(parents=True, exist_ok=True)
+        m = np.asarray(scores) >= conf
+        rows = np.column_stack([np.asarray(classes)[m], xyxy_to_yolo(np.asarray(boxes).reshape(-1, 4)[m], img_w, img_h)])
+        with open(os.path.join(labels_dir, Path(name).stem + '.txt'), 'w') as f:
+            f.write(('%d %.6f %.6f %.6f %.6f\n' * len(rows)) % tuple(rows.ravel().tolist()))
+    if save_img:
+        Path(out_dir).mkdir(parents=True, exist_ok=True)
+        annotated = draw_boxes_pil(img.copy(), boxes, scores, classes, names, conf)
+        annotated.save(os.path.join(out_dir, name))
+
+class ColumnarSink:
+    # One output file for a whole run instead of a label .txt per image. Rows are buffered and written every
+    # chunk_images images, so memory stays bounded however many images go through. Per detection: class, box as
+    # normalized cx, cy, w, h (the YOLO label convention) and conf; per image: path and size.
+    suffix = None
+
+    def __init__(self, path, chunk_images=1024):
+        self.path = str(path)
+        self.chunk_images = max(1, int(chunk_images))
+        self.images = 0
+        self.detections = 0
+        self._reset()
+
+    def _reset(self):
+        self._paths, self._sizes, self._counts, self._cls, self._boxes, self._conf = [], [], [], [], [], []
+
+    def add(self, path, img_size, boxes, scores, classes, conf=0.0):
+        m = np.asarray(scores) >= conf
+        boxes = np.asarray(boxes, dtype=np.float32).reshape(-1, 4)[m]
+        self._paths.append(str(path))
+        self._sizes.append(img_size)
+        self._counts.append(len(boxes))
+        self._cls.append(np.asarray(classes)[m].astype(np.int16))
+        self._boxes.append(xyxy_to_yolo(boxes, *img_size).astype(np.float32))
+        self._conf.append(np.asarray(scores)[m].astype(np.float32))
+        if len(self._paths) >= self.chunk_images:
+            self.flush()
+
+    def flush(self):
+        if not self._paths:
+            return
+        counts = np.asarray(self._counts, dtype=np.int64)
+        self._write(self._paths, np.asarray(self._sizes, dtype=np.int32).reshape(-1, 2), counts,
+                    np.concatenate(self._cls), np.concatenate(self._boxes).reshape(-1, 4), np.concatenate(self._conf))
+        self.images += len(counts)
+        self.detections += int(counts.sum())
+        self._reset()
+
+    def close(self):
+        self.flush()
+        self._finish()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _write(self, paths, sizes, counts, cls, boxes, conf):
+        raise NotImplementedError
+
+    def _finish(self):
+        pass
+
+class JsonlSink(ColumnarSink):
+    # one JSON object per image: {"path", "width", "height", "cls": [...], "box": [[cx, cy, w, h], ...], "conf": [...]}
+    suffix = '.jsonl'
+
+    def __init__(self, path, chunk_images=1024):
+        super().__init__(path, chunk_images)
+        self._f = open(self.path, 'w')
+
+    def _write(self, paths, sizes, counts, cls, boxes, conf):
+        ends = np.cumsum(counts)
+        cls, boxes, conf = cls.tolist(), boxes.astype(np.float64).round(6).tolist(), conf.astype(np.float64).round(6).tolist()
+        lines = [json.dumps({'path': p, 'width': int(w), 'height': int(h), 'cls': cls[e - n:e],
+                             'box': boxes[e - n:e], 'conf': conf[e - n:e]})
+                 for p, (w, h), n, e in zip(paths, sizes.tolist(), counts.tolist(), ends.tolist())]
+        self._f.write('\n'.join(lines) + '\n')
+
+    def _finish(self):
+        self._f.close()
+
+class ParquetSink(ColumnarSink):
+    # one row per image: path, width, height and list columns cls, cx, cy, w, h, conf (requires pyarrow)
+    suffix = '.parquet'
+
+    def __init__(self, path, chunk_images=1024):
+        import pyarrow.parquet as pq
+        super().__init__(path, chunk_images)
+        self._pq = pq
+        self._writer = None
+
+    def _write(self, paths, sizes, counts, cls, boxes, conf):
+        import pyarrow as pa
+        offsets = pa.array(np.concatenate([[0], np.cumsum(counts)]).astype(np.int32))
+        lists = {name: pa.ListArray.from_arrays(offsets, pa.array(col))
+                 for name, col in (('cls', cls), ('cx', boxes[:, 0]), ('cy', boxes[:, 1]), ('w', boxes[:, 2]),
+                                   ('h', boxes[:, 3]), ('conf', conf))}
+        table = pa.table({'path': paths, 'width': sizes[:, 0], 'height': sizes[:, 1], **lists})
+        if self._writer is None:
+            self._writer = self._pq.ParquetWriter(self.path, table.schema)
+        self._writer.write_table(table)
+
+    def _finish(self):
+        if self._writer is not None:
+            self._writer.close()
+
+class NpzSink(ColumnarSink):
+    # concatenated arrays: cls (N,), box (N, 4), conf (N,) over all detections; path (M,), size (M, 2) and
+    # offset (M + 1,) per image, so image i owns rows offset[i]:offset[i + 1]. Chunks are appended to raw
+    # column files and streamed into the .npz at close.
+    suffix = '.npz'
+    _columns = (('cls', np.int16, ()), ('box', np.float32, (4,)), ('conf', np.float32, ()),
+                ('count', np.int64, ()), ('size', np.int32, (2,)))
+
+    def __init__(self, path, chunk_images=1024):
+        super().__init__(path, chunk_images)
+        self._parts = tempfile.mkdtemp(prefix='.detections.', dir=os.path.dirname(os.path.abspath(self.path)))
+        self._files = {name: open(os.path.join(self._parts, name), 'wb') for name, _, _ in self._columns}
+        self._path_file = open(os.path.join(self._parts, 'path'), 'w', encoding='utf-8')
+
+    def _write(self, paths, sizes, counts, cls, boxes, conf):
+        for name, col in (('cls', cls), ('box', boxes), ('conf', conf), ('count', counts), ('size', sizes)):
+            self._files[name].write(np.ascontiguousarray(col).tobytes())
+        self._path_file.write(''.join(p + '\n' for p in paths))
+
+    def _finish(self):
+        import zipfile
+        for f in self._files.values():
+            f.close()
+        self._path_file.close()
+        try:
+            with open(os.path.join(self._parts, 'path'), encoding='utf-8') as f:
+                paths = np.array(f.read().splitlines(), dtype=str)
+            counts = np.fromfile(os.path.join(self._parts, 'count'), dtype=np.int64)
+            tmp = f'{self.path}.{os.getpid()}.tmp'
+            with zipfile.ZipFile(tmp, 'w', zipfile.ZIP_STORED, allowZip64=True) as zf:
+                for name, arr in (('path', paths), ('offset', np.concatenate([[0], np.cumsum(counts)]).astype(np.int64))):
+                    with zf.open(f'{name}.npy', 'w', force_zip64=True) as f:
+                        np.lib.format.write_array(f, arr, allow_pickle=False)
+                for name, dtype, shape in self._columns:
+                    if name == 'count':
                         continue
-                    cx, cy, w, h = xyxy_to_yolo((x1, y1, x2, y2), img_w, img_h)
-                    f.write(f"{int(c)} {cx:.6f} {cy:.6f} {w:.6f} {h:.6f}\n")
+                    raw = os.path.join(self._parts, name)
+                    n = os.path.getsize(raw) // (np.dtype(dtype).itemsize * int(np.prod(shape, dtype=np.int64)))
+                    with zf.open(f'{name}.npy', 'w', force_zip64=True) as f, open(raw, 'rb') as src:
+                        np.lib.format.write_array_header_1_0(f, {'descr': np.lib.format.dtype_to_descr(np.dtype(dtype)),
+                                                                 'fortran_order': False, 'shape': (n, *shape)})
+                        shutil.copyfileobj(src, f, 1 << 20)
+            os.replace(tmp, self.path)
+        finally:
+            shutil.rmtree(self._parts, ignore_errors=True)
+
+SINKS = {'jsonl': JsonlSink, 'parquet': ParquetSink, 'npz': NpzSink}
+
+IMAGE_SUFFIXES = ('.jpg', '.jpeg', '.png')
+VIDEO_SUFFIXES = ('.mp4', '.avi', '.mov', '.mkv', '.webm')
+
+def _decode(item):
+    # path, encoded bytes or PIL image -> RGB PIL image
+    if isinstance(item, Image.Image):
+        return item.convert('RGB')
+    if isinstance(item, (bytes, bytearray, memoryview)):
+        return Image.open(io.BytesIO(item)).convert('RGB')
+    return Image.open(item).convert('RGB')
+
+def iter_video(path, stride=1):
+    # decode frames one at a time -> ('<path>:<frame>', RGB PIL image); every `stride`-th frame
+    import cv2
+    cap = cv2.VideoCapture(str(path))
+    if not cap.isOpened():
+        raise FileNotFoundError(f"Cannot open video: {path}")
+    try:
+        i = 0
+        while True:
+            ok = cap.grab()
+            if not ok:
+                break
+            if i % stride == 0:
+                ok, frame = cap.retrieve()
+                if ok:
+                    yield f"{path}:{i}", Image.fromarray(frame[:, :, ::-1])
+            i += 1
+    finally:
+        cap.release()
+
+def iter_sources(source, vid_stride=1):
+    # lazily yield (name, item) where item is a path, encoded bytes or PIL image; nothing is read here
+    # except video frames. source: image file, dir, glob pattern, video file, bytes, PIL image, or an
+    # iterable of paths / bytes / PIL images (a generator is consumed as it goes).
+    if isinstance(source, (bytes, bytearray, memoryview, Image.Image)):
+        yield '0', source
+        return
+    if isinstance(source, (str, Path)):
+        # a glob can match videos as well as images, so every path goes through the same check
+        source = collect_sources(str(source))
+    for i, item in enumerate(source):
+        if isinstance(item, (str, Path)) and Path(item).suffix.lower() in VIDEO_SUFFIXES:
+            yield from iter_video(item, vid_stride)
+        elif isinstance(item, (str, Path)):
+            yield str(item), str(item)
+        else:
+            yield str(i), item
+
+def prefetch(items, load=_decode, workers=None, ahead=16):
+    # (name, item) pairs -> (name, load(item)) in order while up to `ahead` loads run in a thread pool, so the
+    # caller never waits on I/O and decoding; memory stays bounded by `ahead` however many items there are
+    workers = workers or min(8, os.cpu_count() or 1)
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='decode') as pool:
+        pending = deque()
+        it = iter(items)
+        for name, item in it:
+            pending.append((name, pool.submit(load, item)))
+            if len(pending) >= ahead:
+                break
+        while pending:
+            name, fut = pending.popleft()
+            nxt = next(it, None)
+            if nxt is not None:
+                pending.append((nxt[0], pool.submit(load, nxt[1])))
+            yield name, fut.result()
 
-        # save annotated image
-        if save_img:
-            annotated = draw_boxes_pil(img.copy(), boxes, scores, classes, model.names, conf)
-            annotated.save(out_img_path)
+def shape_batches(items, batch, key, max_pending=None):
+    # group (name, img) items into lists of up to `batch` with the same key(img); a bucket is emitted when it is
+    # full, or (largest first) when more than max_pending images are held back, and the rest at the end
+    max_pending = max_pending or batch * 4
+    buckets, held = {}, 0
+    for item in items:
+        k = key(item[-1])
+        bucket = buckets.setdefault(k, [])
+        bucket.append(item)
+        held += 1
+        if len(bucket) >= batch:
+            held -= len(bucket)
+            yield buckets.pop(k)
+        elif held > max_pending:
+            k = max(buckets, key=lambda k: len(buckets[k]))
+            held -= len(buckets[k])
+            yield buckets.pop(k)
+    yield from buckets.values()
 
-        print(f"Processed {img_path} -> {out_img_path if save_img else out_dir}")
+def collect_sources(source):
+    p = Path(source)
+    if p.is_dir():
+        return sorted([str(x) for x in p.glob('*') if x.suffix.lower() in IMAGE_SUFFIXES])
+    if p.is_file():
+        return [str(p)]
+    srcs = sorted(glob.glob(source))
+    if not srcs:
+        raise FileNotFoundError(f"No source files found for: {source}")
+    return srcs
+
+def iter_detections(source, weights=None, conf=0.25, detector=None, backend='auto', batch=1, imgsz=640,
+                    vid_stride=1, return_image=False):
+    # Stream detections: one dict per image with index (position in source), path, img_size (w, h) and
+    # boxes (xyxy) / scores / classes above conf, plus the decoded image when return_image is set.
+    # Sources are read lazily (see iter_sources) and decoded ahead of the model by a thread pool, so memory
+    # stays flat however large the corpus. batch > 1 runs one forward pass per `batch` images of the same
+    # model input shape; batches then finish out of source order, which `index` records.
+    detector = detector or load_detector(weights, backend=backend, conf=conf, imgsz=imgsz)
+    # detectors with a fixed input (onnx, mapped) letterbox everything to one shape; ultralytics only pads a
+    # batch to a minimal rectangle when every image in it has the same size (else each goes to a full
+    # imgsz square), so group by the original size
+    if hasattr(detector, 'input_shape'):
+        fixed = detector.input_shape(imgsz)
+        key = lambda img: fixed
+    else:
+        key = lambda img: img.size
+    batch = max(1, int(batch))
+    items = (((i, name), item) for i, (name, item) in enumerate(iter_sources(source, vid_stride)))
+    loaded = ((i, name, img) for (i, name), img in prefetch(items, ahead=max(16, 2 * batch)))
+    for group in shape_batches(loaded, batch, key):
+        preds = detector.predict([img for _, _, img in group], conf=conf, imgsz=imgsz)
+        for (i, name, img), (boxes, scores, classes) in zip(group, preds):
+            keep = scores >= conf
+            det = {'index': i, 'path': name, 'img_size': img.size,
+                   'boxes': boxes[keep], 'scores': scores[keep], 'classes': classes[keep]}
+            if return_image:
+                det['image'] = img
+            yield det
+
+def run(weights, source, conf, save_txt, save_img, detector=None, backend='auto', batch=1, imgsz=640, save_format='txt'):
+    # returns one dict per image (in source order): index, path, img_size (w, h) and boxes (xyxy) / scores / classes
+    # above conf. Files are only written (to a fresh runs/detect/expN) when save_txt, save_img or a columnar
+    # save_format ('jsonl', 'parquet', 'npz': one detections.<format> for the whole run instead of label .txt files) is set.
+    detector = detector or load_detector(weights, backend=backend, conf=conf, imgsz=imgsz)
+    srcs = collect_sources(source)
+
+    # prepare output folder
+    out_dir = None
+    if save_txt or save_img or save_format != 'txt':
+        base_runs = os.path.join(Path(__file__).parent, 'runs', 'detect')
+        out_dir = next_exp_dir(base=base_runs)
+        print(f"Found {len(srcs)} images. Saving results to: {out_dir}")
+    else:
+        print(f"Found {len(srcs)} images.")
+
+    sink = SINKS[save_format](os.path.join(out_dir, 'detections' + SINKS[save_format].suffix)) if save_format != 'txt' else None
+    results = []
+    try:
+        for det in iter_detections(srcs, conf=conf, detector=detector, batch=batch, imgsz=imgsz, return_image=bool(out_dir)):
+            img_path = det['path']
+            if sink is not None:
+                sink.add(img_path, det['img_size'], det['boxes'], det['scores'], det['classes'])
+            if out_dir:
+                save_result(out_dir, Path(img_path).name, det.pop('image'), det['boxes'], det['scores'], det['classes'],
+                            detector.names, conf, save_txt and sink is None, save_img)
+                print(f"Processed {img_path} -> {os.path.join(out_dir, Path(img_path).name) if save_img else out_dir}")
+            else:
+                print(f"Processed {img_path}")
+            results.append(det)
+    finally:
+        if sink is not None:
+            sink.close()
+            print(f"Wrote {sink.detections} detections for {sink.images} images to {sink.path}")
+    results.sort(key=lambda r: r['index'])
+    return results
 
 def parse_args_and_run():
     parser = argparse.ArgumentParser(
         description="Simple detect wrapper (writes runs/detect/exp*/ images + labels)"
     )
     parser.add_argument('--weights', type=str, default='models/best.pt', help='path to .pt weights')
-    parser.add_argument('--source', type=str, required=True, help='image file, dir, or glob pattern')
+    parser.add_argument('--source', type=str, help='image file, dir, or glob pattern')
     parser.add_argument('--conf', type=float, default=0.25, help='confidence threshold (0-1)')
     parser.add_argument('--save-txt', action='store_true', help='save labels in YOLO format')
     parser.add_argument('--save-img', action='store_true', help='save annotated images')
+    parser.add_argument('--save-format', choices=['txt', *SINKS], default='txt',
+                        help='txt: one YOLO label file per image (with --save-txt); jsonl/parquet/npz: one detections file per run')
+    parser.add_argument('--backend', choices=['auto', 'torch', 'onnx'], default='auto',
+                        help="inference backend; 'onnx' exports <weights>.onnx on first use")
+    parser.add_argument('--export-onnx', action='store_true', help='export --weights to ONNX and exit')
+    parser.add_argument('--cache-hub', action='store_true', help='fetch the torch.hub fallback repo into the local cache and exit')
+    parser.add_argument('--imgsz', type=int, default=640, help='inference / export image size')
+    parser.add_argument('--batch', type=int, default=1, help='images per forward pass (grouped by letterboxed shape)')
     args = parser.parse_args()
-    run(args.weights, args.source, args.conf, args.save_txt, args.save_img)
+    if args.cache_hub:
+        print(f"Cached {HUB_REPO}@{HUB_REF} in {resolve_hub_repo()}")
+        return
+    if not args.export_onnx and not args.source:
+        parser.error('--source is required')
+    if args.export_onnx:
+        print(f"Exported {resolve_onnx(args.weights, imgsz=args.imgsz)}")
+        return
+    run(args.weights, args.source, args.conf, args.save_txt, args.save_img, backend=args.backend,
+        batch=args.batch, imgsz=args.imgsz, save_format=args.save_format)
 
 if __name__ == "__main__":
     parse_args_and_run()